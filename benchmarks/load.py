@@ -0,0 +1,388 @@
+"""
+load benchmark, running the bot offline against a fake gateway.
+
+Synthetic guilds, channels, members and messages are dispatched to the bot
+as if they came from Discord, at a fixed rate or as fast as possible, and
+the messages the bot sends go to fake channels which stand in for the REST
+API. The bot loads the base plugin and the sample plugins in
+benchmarks/plugins.
+
+The messages are generated from a seed, so runs are repeatable. Save the
+results of one run with --json and compare later runs against them with
+--compare, which exits with status 1 if throughput or latency regressed.
+
+usage: python benchmarks/load.py [--messages N] [--rate PER_SECOND] ...
+"""
+
+import argparse
+import asyncio
+import gc
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from unibot.bot import Bot
+
+PLUGINS = Path(__file__).parent / "plugins"
+
+# (weight, content) of the messages sent; {n} is replaced with a number
+MESSAGES = [
+    (40, "just chatting about nothing in particular {n}"),
+    (5, "~help"),
+    (5, "~help config"),
+    (3, "~help sample --page 1"),
+    (10, "~permissions show"),
+    (2, "~plugins stats"),
+    (20, "~sample echo some words {n}"),
+    (10, "~sample sum 1 2 3 {n}"),
+    (2, "~sample hash text{n} --rounds 200"),
+    # the same arguments every time, so mostly cached
+    (2, "~sample hash text --rounds 200"),
+    (3, "~no-such-command {n}"),
+]
+
+_ids = itertools.count(1 << 40)
+
+
+class FakeChannel:
+    """
+    a text channel, which stands in for the REST API when sending
+    """
+
+    def __init__(self, gateway, guild=None):
+        self.gateway = gateway
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = f"channel-{self.id}"
+        self.mention = f"<#{self.id}>"
+
+    async def send(self, content=None, **kwargs):
+        self.gateway.sent += 1
+        if self.gateway.rest_latency:
+            await asyncio.sleep(self.gateway.rest_latency)
+        return FakeMessage(self.gateway, content or "", self.gateway.me, self)
+
+
+class FakeRole:
+    def __init__(self, id):
+        self.id = id
+        self.permissions = SimpleNamespace(administrator=False)
+
+
+class FakeMember:
+    def __init__(self, gateway, guild, roles):
+        self.gateway = gateway
+        self.id = next(_ids)
+        self.guild = guild
+        self.roles = roles
+        self.name = self.display_name = f"user-{self.id}"
+        self.mention = f"<@{self.id}>"
+        self.guild_permissions = SimpleNamespace(administrator=False)
+        self.dm_channel = None
+
+    async def create_dm(self):
+        self.dm_channel = FakeChannel(self.gateway)
+        return self.dm_channel
+
+
+class FakeGuild:
+    def __init__(self, gateway, channels, members):
+        self.id = next(_ids)
+        # the @everyone role has the guild's ID
+        everyone = FakeRole(self.id)
+        self.roles = [everyone, FakeRole(next(_ids))]
+        self.channels = [FakeChannel(gateway, self) for _ in range(channels)]
+        self.members = [
+            FakeMember(gateway, self, [everyone, *self.roles[1 : i % 2 + 1]])
+            for i in range(members)
+        ]
+        self._members_by_id = {member.id: member for member in self.members}
+
+    def get_member(self, id):
+        return self._members_by_id.get(id)
+
+
+class FakeMessage:
+    def __init__(self, gateway, content, author, channel):
+        self.gateway = gateway
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+
+    async def add_reaction(self, emoji):
+        self.gateway.sent += 1
+        if self.gateway.rest_latency:
+            await asyncio.sleep(self.gateway.rest_latency)
+
+
+class FakeGateway:
+    def __init__(self, guilds, channels, members, rest_latency, seed):
+        self.rest_latency = rest_latency
+        # the number of requests made to the REST API
+        self.sent = 0
+        self.me = SimpleNamespace(id=next(_ids), mention="<@bot>")
+        self.guilds = [
+            FakeGuild(self, channels, members) for _ in range(guilds)
+        ]
+        self.random = random.Random(seed)
+
+    def messages(self, count):
+        weights, contents = zip(*MESSAGES)
+        for n in range(count):
+            guild = self.random.choice(self.guilds)
+            content = self.random.choices(contents, weights)[0]
+            yield FakeMessage(
+                self,
+                content.format(n=n),
+                self.random.choice(guild.members),
+                self.random.choice(guild.channels),
+            )
+
+
+def write_config(directory, gateway):
+    config = {
+        "core": {
+            "prefix": "~",
+            "log_level": "WARNING",
+            "watch_config": False,
+            "loop_lag_threshold": None,
+        },
+        "plugins": {
+            "plugin_search_directories": [str(PLUGINS)],
+            "plugin_index_path": None,
+        },
+        "permissions": {
+            "roles": {str(guild.id): ["sample.use"] for guild in gateway.guilds}
+        },
+    }
+    credentials = {"core": {"client_id": "0", "bot_token": "benchmark"}}
+    config_file = os.path.join(directory, "config.json")
+    credentials_file = os.path.join(directory, "credentials.json")
+    with open(config_file, "w") as f:
+        json.dump(config, f)
+    with open(credentials_file, "w") as f:
+        json.dump(credentials, f)
+    return config_file, credentials_file
+
+
+def memory():
+    """
+    :return: the resident set size in bytes, and the number of objects
+    tracked by the garbage collector
+    """
+    gc.collect()
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # the peak rather than the current size
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return rss, len(gc.get_objects())
+
+
+async def settle():
+    """
+    waits until every task started by the messages has finished
+    """
+    current = asyncio.current_task()
+    while any(task is not current for task in asyncio.all_tasks()):
+        await asyncio.sleep(0.001)
+
+
+async def drive(bot, messages, rate):
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    for i, message in enumerate(messages):
+        if rate:
+            delay = start + i / rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif i % 100 == 0:
+            # let the commands run, rather than queueing every message first
+            await asyncio.sleep(0)
+        bot.dispatch("message", message)
+    await settle()
+
+
+def run(args):
+    gateway = FakeGateway(
+        args.guilds, args.channels, args.members, args.rest_latency, args.seed
+    )
+    warmup = list(gateway.messages(args.warmup))
+    messages = list(gateway.messages(args.messages))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    with tempfile.TemporaryDirectory() as directory:
+        bot = Bot(*write_config(directory, gateway))
+        with bot.global_bot_context:
+            bot.setup()
+            if not args.rate_limits:
+                # measure the bot rather than Discord's rate limits
+                bot.outbound.ROUTE_LIMITS = {
+                    route: (10**9, 1.0) for route in bot.outbound.ROUTE_LIMITS
+                }
+
+            loop.run_until_complete(drive(bot, warmup, args.rate))
+            bot.plugin_manager.stats.clear()
+            bot.plugin_manager._module_stats.clear()
+            sent = gateway.sent
+            rss, objects = memory()
+
+            start = time.perf_counter()
+            cpu = time.process_time()
+            loop.run_until_complete(drive(bot, messages, args.rate))
+            elapsed = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+
+            rss_after, objects_after = memory()
+            results = {
+                "messages": len(messages),
+                "seconds": elapsed,
+                "cpu_seconds": cpu,
+                "messages_per_second": len(messages) / elapsed,
+                "requests_sent": gateway.sent - sent,
+                "rss_growth_bytes": rss_after - rss,
+                "object_growth": objects_after - objects,
+                "plugins": {
+                    name: {
+                        "commands": stats.commands.count,
+                        "exceptions": stats.commands.exceptions,
+                        "p50": stats.commands.percentile(50),
+                        "p99": stats.commands.percentile(99),
+                    }
+                    for name, stats in bot.plugin_manager.stats.items()
+                },
+            }
+            loop.run_until_complete(bot.close())
+    loop.close()
+    return results
+
+
+def report(results):
+    def ms(seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.2f}"
+
+    print(
+        f"{results['messages']} messages in {results['seconds']:.2f}s "
+        f"({results['messages_per_second']:.0f}/s, "
+        f"{results['cpu_seconds']:.2f}s CPU), "
+        f"{results['requests_sent']} requests sent"
+    )
+    print(
+        f"memory growth: {results['rss_growth_bytes'] / 1024:.0f} KiB RSS, "
+        f"{results['object_growth']} objects"
+    )
+    print(
+        f"{'plugin':<20} {'commands':>8} {'errors':>6} {'p50 ms':>8} "
+        f"{'p99 ms':>8}"
+    )
+    for name, stats in sorted(results["plugins"].items()):
+        if not stats["commands"]:
+            continue
+        print(
+            f"{name[:20]:<20} {stats['commands']:>8} {stats['exceptions']:>6} "
+            f"{ms(stats['p50']):>8} {ms(stats['p99']):>8}"
+        )
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: descriptions of the regressions from the baseline
+    """
+    regressions = []
+
+    def check(name, value, before, higher_is_better=False):
+        if value is None or not before:
+            return
+        change = (value - before) / before
+        if higher_is_better:
+            change = -change
+        if change > tolerance:
+            regressions.append(
+                f"{name}: {before:.6g} -> {value:.6g} ({change:+.0%} worse)"
+            )
+
+    check(
+        "messages/s",
+        results["messages_per_second"],
+        baseline["messages_per_second"],
+        higher_is_better=True,
+    )
+    for name, stats in results["plugins"].items():
+        before = baseline["plugins"].get(name)
+        if before is not None:
+            check(f"{name} p50", stats["p50"], before["p50"])
+            check(f"{name} p99", stats["p99"], before["p99"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark the bot against a fake gateway"
+    )
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=500,
+        help="messages sent before measuring, to fill caches",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="messages per second, or 0 for as fast as possible",
+    )
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument(
+        "--rest-latency",
+        type=float,
+        default=0.0,
+        help="seconds each request to the fake REST API takes",
+    )
+    parser.add_argument(
+        "--rate-limits",
+        action="store_true",
+        help="keep Discord's rate limits on sending",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument(
+        "--compare", help="compare the results with those in this file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="the fraction by which results may be worse than the baseline",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
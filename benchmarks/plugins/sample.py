@@ -0,0 +1,86 @@
+"""
+a plugin with the kinds of commands and listeners real plugins have, for the
+load benchmark
+"""
+
+import hashlib
+
+from unibot._globals import bot
+from unibot.command import (
+    BaseCommand,
+    CommandWithSubCommands,
+    cacheable,
+    require_permission,
+)
+from unibot.plugin_manager import PluginManifest
+
+
+class __manifest__(PluginManifest):
+    name = "sample"
+    version = "1.0"
+    description = "sample plugin for benchmarks"
+
+
+@bot.command
+class Sample(CommandWithSubCommands):
+    name = "sample"
+
+
+@Sample.command
+@require_permission("sample.use")
+class Echo(BaseCommand):
+    name = "echo"
+    help = "replies with its arguments"
+
+    def initialise(self):
+        self.add_argument("words", nargs="*")
+
+    async def callback(self, message, words):
+        await bot.send(message.channel, " ".join(words))
+
+
+@Sample.command
+class Sum(BaseCommand):
+    name = "sum"
+    help = "adds up numbers, in a synchronous callback"
+
+    def initialise(self):
+        self.add_argument("numbers", nargs="*", type=float)
+
+    def callback(self, message, numbers):
+        return str(sum(numbers))
+
+
+@Sample.command
+@cacheable(60.0)
+class Hash(BaseCommand):
+    name = "hash"
+    help = "hashes text many times, in the process pool, caching the result"
+
+    def initialise(self):
+        self.add_argument("text")
+        self.add_argument("--rounds", type=int, default=1000)
+
+    @staticmethod
+    def compute(text, rounds):
+        digest = text.encode()
+        for _ in range(rounds):
+            digest = hashlib.sha256(digest).digest()
+        return digest.hex()
+
+    async def callback(self, message, digest):
+        return digest
+
+
+words_seen = 0
+
+
+@bot.event_listener("message")
+async def count_words(message):
+    global words_seen
+    words_seen += len(message.content.split())
+
+
+@bot.event_listener("typing", inline=True)
+def on_typing(channel, user, when):
+    pass
@@ -0,0 +1,272 @@
+"""
+replay benchmark, running the bot offline against a recorded gateway session.
+
+Record a session by setting gateway_record_path in the core config of a
+running bot, then replay it here against the same config, or another build
+of the bot or its plugins, to compare them under real traffic. The frames
+are replayed at the recorded pace or faster, or as fast as possible with
+--speed 0. Requests to the REST API aren't made; those which send or edit
+messages, or open DMs, return fakes.
+
+Save the results of one run with --json and compare later runs against them
+with --compare, which exits with status 1 if CPU time, allocations or latency
+regressed.
+
+usage: python benchmarks/replay.py LOG --config FILE --credentials FILE ...
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from load import memory, settle
+from unibot.bot import Bot
+from unibot.gateway_log import GatewayReplayer
+
+
+class FakeHTTP:
+    """
+    stands in for the REST API, in place of the bot's HTTPClient.request
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.requests = Counter()
+        self._ids = iter(range(1 << 40, 1 << 41))
+
+    async def request(self, route, *, files=None, **kwargs):
+        self.requests[f"{route.method} {route.path}"] += 1
+        if route.path.startswith("/channels/{channel_id}/messages"):
+            if route.method in ("POST", "PATCH"):
+                return self._message(route.channel_id, kwargs.get("json"))
+        if route.method == "POST" and route.path == "/users/@me/channels":
+            return self._dm_channel(int(kwargs["json"]["recipient_id"]))
+        return None
+
+    @staticmethod
+    def _user(user):
+        return {
+            "id": str(user.id),
+            "username": user.name,
+            "discriminator": user.discriminator,
+            "avatar": None,
+            "bot": user.bot,
+        }
+
+    def _dm_channel(self, recipient_id):
+        recipient = self.bot.get_user(recipient_id)
+        return {
+            "id": str(next(self._ids)),
+            "type": 1,
+            "last_message_id": None,
+            "recipients": [
+                (
+                    self._user(recipient)
+                    if recipient
+                    else {
+                        "id": str(recipient_id),
+                        "username": "unknown",
+                        "discriminator": "0000",
+                        "avatar": None,
+                    }
+                )
+            ],
+        }
+
+    def _message(self, channel_id, payload):
+        payload = payload or {}
+        return {
+            "id": str(next(self._ids)),
+            "channel_id": str(channel_id),
+            "author": self._user(self.bot.user),
+            "content": payload.get("content") or "",
+            "embeds": [payload["embed"]] if payload.get("embed") else [],
+            "attachments": [],
+            "mentions": [],
+            "mention_roles": [],
+            "mention_everyone": False,
+            "pinned": False,
+            "tts": bool(payload.get("tts")),
+            "type": 0,
+            "timestamp": "2019-01-01T00:00:00+00:00",
+            "edited_timestamp": None,
+        }
+
+
+def run(args):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    bot = Bot(args.config, args.credentials)
+    with bot.global_bot_context:
+        bot.setup()
+        http = FakeHTTP(bot)
+        bot.http.request = http.request
+        # there is no gateway to request members or send frames to
+        bot._connection._fetch_offline = False
+        bot._connection.shard_count = bot.shard_count or 1
+        if not args.rate_limits:
+            bot.outbound.ROUTE_LIMITS = {
+                route: (10**9, 1.0) for route in bot.outbound.ROUTE_LIMITS
+            }
+        replayer = GatewayReplayer(bot, args.log)
+
+        rss, objects = memory()
+        if args.trace_allocations:
+            tracemalloc.start()
+        start = time.perf_counter()
+        cpu = time.process_time()
+        loop.run_until_complete(replayer.replay(args.speed))
+        # not counting the wait for the tasks left, which includes the delay
+        # after the last guild before the ready event
+        elapsed = time.perf_counter() - start
+        loop.run_until_complete(settle())
+        cpu = time.process_time() - cpu
+        allocated = peak = None
+        if args.trace_allocations:
+            allocated, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        rss_after, objects_after = memory()
+        results = {
+            "frames": replayer.frames,
+            "events": replayer.events,
+            "seconds": elapsed,
+            "cpu_seconds": cpu,
+            "events_per_second": replayer.events / elapsed,
+            "requests": dict(http.requests),
+            "rss_growth_bytes": rss_after - rss,
+            "object_growth": objects_after - objects,
+            "allocated_bytes": allocated,
+            "peak_allocated_bytes": peak,
+            "plugins": {
+                name: {
+                    "commands": stats.commands.count,
+                    "exceptions": stats.commands.exceptions,
+                    "p50": stats.commands.percentile(50),
+                    "p99": stats.commands.percentile(99),
+                    "listener_exceptions": stats.listeners.exceptions,
+                }
+                for name, stats in bot.plugin_manager.stats.items()
+            },
+        }
+        loop.run_until_complete(bot.close())
+    loop.close()
+    return results
+
+
+def report(results):
+    def ms(seconds):
+        return "-" if seconds is None else f"{seconds * 1000:.2f}"
+
+    print(
+        f"{results['frames']} frames, {results['events']} events in "
+        f"{results['seconds']:.2f}s ({results['events_per_second']:.0f}/s, "
+        f"{results['cpu_seconds']:.2f}s CPU), "
+        f"{sum(results['requests'].values())} requests"
+    )
+    print(
+        f"memory growth: {results['rss_growth_bytes'] / 1024:.0f} KiB RSS, "
+        f"{results['object_growth']} objects"
+    )
+    if results["peak_allocated_bytes"] is not None:
+        print(
+            f"allocated: {results['allocated_bytes'] / 1024:.0f} KiB, "
+            f"peak {results['peak_allocated_bytes'] / 1024:.0f} KiB"
+        )
+    print(
+        f"{'plugin':<20} {'commands':>8} {'errors':>6} {'p50 ms':>8} "
+        f"{'p99 ms':>8}"
+    )
+    for name, stats in sorted(results["plugins"].items()):
+        if not stats["commands"]:
+            continue
+        print(
+            f"{name[:20]:<20} {stats['commands']:>8} {stats['exceptions']:>6} "
+            f"{ms(stats['p50']):>8} {ms(stats['p99']):>8}"
+        )
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: descriptions of the regressions from the baseline
+    """
+    regressions = []
+
+    def check(name, value, before):
+        if value is None or not before:
+            return
+        change = (value - before) / before
+        if change > tolerance:
+            regressions.append(
+                f"{name}: {before:.6g} -> {value:.6g} ({change:+.0%} worse)"
+            )
+
+    check("CPU seconds", results["cpu_seconds"], baseline["cpu_seconds"])
+    check(
+        "peak allocated bytes",
+        results["peak_allocated_bytes"],
+        baseline.get("peak_allocated_bytes"),
+    )
+    for name, stats in results["plugins"].items():
+        before = baseline["plugins"].get(name)
+        if before is not None:
+            check(f"{name} p50", stats["p50"], before["p50"])
+            check(f"{name} p99", stats["p99"], before["p99"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark the bot against a recorded gateway session"
+    )
+    parser.add_argument("log", help="a log recorded with gateway_record_path")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--credentials", default="credentials.json")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="a multiple of the recorded pace, or 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--rate-limits",
+        action="store_true",
+        help="keep Discord's rate limits on sending",
+    )
+    parser.add_argument(
+        "--trace-allocations",
+        action="store_true",
+        help="count memory allocations, which slows the bot down",
+    )
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument(
+        "--compare", help="compare the results with those in this file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="the fraction by which results may be worse than the baseline",
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
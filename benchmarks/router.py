@@ -0,0 +1,72 @@
+"""
+benchmark for command parsing, comparing parsing with the full argparse tree
+against resolving with the compiled command router.
+
+usage: python benchmarks/router.py [iterations]
+"""
+
+import sys
+import timeit
+
+from unibot.command import BaseCommand, CommandWithSubCommands
+from unibot.parser import UnibotParser
+from unibot.router import CommandRouter
+
+GROUPS = 30
+COMMANDS_PER_GROUP = 10
+
+CASES = [
+    ["help"],
+    ["group0", "command0", "value"],
+    ["group29", "command9", "value", "--flag", "--count", "3"],
+    ["group0", "nested", "deeper", "leaf", "value", "--count", "3"],
+]
+
+
+class _Command(BaseCommand):
+    def initialise(self):
+        self.add_argument("value", nargs="?")
+        self.add_argument("--flag", action="store_true")
+        self.add_argument("--count", type=int, default=1)
+
+    async def callback(self, message, **kwargs):
+        ...
+
+
+def build_tree():
+    root_class = CommandWithSubCommands.new("root")
+    root_class.command(BaseCommand.new("help"))
+    for i in range(GROUPS):
+        group = root_class.command(CommandWithSubCommands.new(f"group{i}"))
+        for j in range(COMMANDS_PER_GROUP):
+            group.command(_Command.new(f"command{j}"))
+    nested = CommandWithSubCommands.new("nested")
+    deeper = nested.command(CommandWithSubCommands.new("deeper"))
+    deeper.command(_Command.new("leaf"))
+    # noinspection PyUnresolvedReferences
+    root_class.commands[1].command(nested)
+
+    root_parser = UnibotParser()
+    return root_parser, root_class(root_parser)
+
+
+def main(iterations=10000):
+    root_parser, root = build_tree()
+    router = CommandRouter(root)
+    print(f"{GROUPS * COMMANDS_PER_GROUP} commands, {iterations} iterations")
+    print(f"{'command':<50} {'argparse':>12} {'router':>12} {'speedup':>8}")
+    for args in CASES:
+        before = timeit.timeit(
+            lambda: root_parser.parse_args(args), number=iterations
+        )
+        after = timeit.timeit(lambda: router.resolve(args), number=iterations)
+        print(
+            f"{' '.join(args):<50} "
+            f"{iterations / before:>8.0f} /s "
+            f"{iterations / after:>8.0f} /s "
+            f"{before / after:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -1,4 +1,4 @@
+__VERSION__ = 0x000100D
+
 from ._globals import bot
 from .bot import Bot
-
-__VERSION__ = 0x000100D
@@ -4,7 +4,54 @@ if sys.version_info < (3, 7):
     print("unsupported python version! please use 3.7+")
     sys.exit(1)
 else:
-    from unibot.bot import Bot
+    import argparse
+    from pathlib import Path
 
-    bot = Bot()
-    bot.run()
+    import unibot._globals
+    import unibot._utils
+    import unibot.supervisor
+    from unibot.bot import Bot, CoreConfig, CoreCredentials
+
+    parser = argparse.ArgumentParser(prog="unibot")
+    parser.add_argument("--config", default="config.json")
+    parser.add_argument("--credentials", default="credentials.json")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="the number of processes to split the shards between "
+        "(default: core.worker_processes in the config)",
+    )
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        help="the total number of shards (default: core.shard_count in the "
+        "config, or as many as Discord recommends)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=unibot.supervisor.parse_shards,
+        help="run only these shards in this process, e.g. '0-3' or '0,2'. "
+        "The supervisor passes this to its workers",
+    )
+    args = parser.parse_args()
+
+    unibot._globals.config.load(Path(args.config))
+    core = CoreConfig()
+    unibot._utils.install_event_loop(core.event_loop)
+    workers = 1
+    if args.shards is None:
+        workers = args.workers or core.worker_processes
+
+    if workers > 1:
+        unibot._globals.credentials.load(Path(args.credentials))
+        supervisor = unibot.supervisor.Supervisor(
+            workers,
+            args.shard_count or core.shard_count,
+            CoreCredentials().bot_token,
+            args.config,
+            args.credentials,
+        )
+        supervisor.run()
+    else:
+        bot = Bot(args.config, args.credentials, args.shards, args.shard_count)
+        bot.run()
@@ -1,14 +1,45 @@
 import asyncio
+import logging
+import os
+import pathlib
 import ssl
+import tempfile
 
 SSL_PROTOCOLS = (asyncio.sslproto.SSLProtocol,)
 try:
+    import uvloop
     import uvloop.loop
 except ImportError:
-    pass
+    uvloop = None
 else:
     SSL_PROTOCOLS = (*SSL_PROTOCOLS, uvloop.loop.SSLProtocol)
 
+EVENT_LOOPS = ("auto", "uvloop", "asyncio")
+
+
+def install_event_loop(name: str) -> str:
+    """
+    sets the event loop implementation used by loops created from now on.
+    This must be called before the bot is created, as it creates its loop.
+    :param name: 'uvloop', 'asyncio', or 'auto' for uvloop if it is installed
+    :return: the name of the implementation installed, which is 'asyncio' if
+    uvloop was asked for but isn't installed
+    """
+    logger = logging.getLogger("unibot.loop")
+    if name not in EVENT_LOOPS:
+        logger.warning("Unknown event loop '%s', using asyncio", name)
+        name = "asyncio"
+    if name == "uvloop" and uvloop is None:
+        logger.warning("uvloop is not installed, using asyncio")
+        name = "asyncio"
+    elif name == "auto":
+        name = "asyncio" if uvloop is None else "uvloop"
+    if name == "uvloop":
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        asyncio.set_event_loop_policy(None)
+    return name
+
 
 def ignore_aiohttp_ssl_error(loop):
     """Ignore aiohttp #3535 / cpython #13548 issue with SSL data after close
@@ -46,3 +77,22 @@ def ignore_aiohttp_ssl_error(loop):
             loop.default_exception_handler(context)
 
     loop.set_exception_handler(ignore_ssl_error)
+
+
+def write_atomic(path: pathlib.Path, data: str):
+    """
+    writes a file by writing to a temporary file and renaming it over the
+    original, so that the file is never left partially written
+    """
+    fd, temp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
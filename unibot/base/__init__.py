@@ -1,11 +1,12 @@
-import asyncio
+import io
+import json
 from datetime import datetime
 
 import discord
 
 from unibot._globals import bot
 from unibot.command import BaseCommand, CommandWithSubCommands
-from . import config
+from . import config, permissions, prefixes
 
 __VERSION__ = 0x000100D
 
@@ -15,12 +16,38 @@ class Help(BaseCommand):
     name = "help"
     help = "provides help for the bot's commands"
 
-    async def callback(self, message: "discord.Message"):
+    def initialise(self):
+        self.add_argument(
+            "query",
+            nargs="*",
+            help="the name of a command, or words to search for",
+        )
+        self.add_argument(
+            "--page", "-p", type=int, default=1, help="the page to show"
+        )
+
+    async def callback(self, message: "discord.Message", query, page):
+        query = " ".join(query)
+        if not query:
+            found = bot.help_index.overview(page)
+        else:
+            found = bot.help_index.command(query, page)
+            if found is None:
+                found = bot.help_index.search(query, page)
+        if found is None:
+            await bot.send(
+                message.channel,
+                f"{message.author.mention} No commands found for '{query}'",
+            )
+            return
+        text, page, pages = found
         # DM the user help
         if not message.author.dm_channel:
             await message.author.create_dm()
-        asyncio.create_task(
-            message.author.dm_channel.send(bot.root_parser.format_help())
+        bot.send(
+            message.author.dm_channel,
+            f"```\n{text}```" + (f"page {page}/{pages}" if pages > 1 else ""),
+            merge=False,
         )
 
 
@@ -40,7 +67,8 @@ class Embed(BaseCommand):
     name = "embed"
 
     async def callback(self, message: "discord.Message"):
-        await message.channel.send(
+        await bot.send(
+            message.channel,
             "message",
             embed=discord.Embed(
                 title="title",
@@ -63,13 +91,78 @@ class ReloadPlugin(BaseCommand):
     name = "reload"
 
     def initialise(self):
-        self.add_argument("plugin", required=True)
+        self.add_argument("plugin")
 
     async def callback(self, message: "discord.Message", plugin):
-        if plugin not in bot.plugin_manager:
-            await message.channel.send(f"Plugin '{plugin}' not found")
+        if plugin not in bot.plugin_manager.plugins:
+            await bot.send(message.channel, f"Plugin '{plugin}' not found")
+        elif await bot.plugin_manager.reload_plugin(plugin):
+            await bot.send(
+                message.channel, f"Plugin '{plugin}' " "successfully reloaded"
+            )
         else:
-            bot.plugin_manager.reload_plugin(plugin)
-            await message.channel.send(
-                f"Plugin '{plugin}' " "successfully reloaded"
+            await bot.send(
+                message.channel, f"Failed to reload plugin '{plugin}'"
             )
+
+
+@Plugins.command
+class ShowPluginStats(BaseCommand):
+    name = "stats"
+    help = (
+        "shows how much time each plugin's commands and listeners take, how "
+        "busy the thread pool is and how well the command cache works"
+    )
+
+    def initialise(self):
+        self.add_argument(
+            "--json",
+            "-j",
+            dest="as_json",
+            action="store_true",
+            help="send the stats as a JSON file",
+        )
+
+    async def callback(self, message: "discord.Message", as_json):
+        stats = bot.plugin_manager.stats
+        if as_json:
+            data = json.dumps(
+                {name: s.as_dict() for name, s in stats.items()}, indent=2
+            )
+            await bot.send(
+                message.channel,
+                file=discord.File(
+                    io.BytesIO(data.encode()), "plugin_stats.json"
+                ),
+            )
+            return
+
+        def ms(seconds):
+            return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+        lines = [
+            f"{'plugin':<20} {'kind':<9} {'calls':>7} {'errors':>6} "
+            f"{'active':>6} {'total s':>8} {'p50 ms':>7} {'p99 ms':>7}"
+        ]
+        for name, plugin_stats in sorted(stats.items()):
+            for kind in ("commands", "listeners"):
+                timings = getattr(plugin_stats, kind)
+                lines.append(
+                    f"{name[:20]:<20} {kind:<9} {timings.count:>7} "
+                    f"{timings.exceptions:>6} {timings.in_flight:>6} "
+                    f"{timings.total_time:>8.2f} "
+                    f"{ms(timings.percentile(50)):>7} "
+                    f"{ms(timings.percentile(99)):>7}"
+                )
+        pool = bot.thread_pool
+        lines.append(
+            f"\nthread pool: {pool.busy}/{pool.size} busy, {pool.queued} "
+            f"queued, all busy {pool.saturated} times, "
+            f"p99 wait {ms(pool.wait.percentile(99))} ms"
+        )
+        cache = bot.command_cache
+        lines.append(
+            f"command cache: {len(cache)}/{cache.size} results, {cache.hits} "
+            f"hits, {cache.misses} misses, {cache.evictions} evicted"
+        )
+        await bot.send(message.channel, "```\n" + "\n".join(lines) + "```")
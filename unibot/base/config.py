@@ -1,28 +1,54 @@
 import json
 
 import discord
-import pydantic
 
-from unibot import bot
-from unibot._globals import config, credentials
-from unibot.command import CommandWithSubCommands, BaseCommand
+from unibot._globals import bot, config, credentials
+from unibot.command import (
+    BaseCommand,
+    CommandWithSubCommands,
+    cacheable,
+    require_permission,
+)
 
+MANAGE = "config.manage"
+# the number of keys listed on each page
+KEYS_PAGE_SIZE = 30
 
-class Test(config.section, name="test"):
+
+class Test(config.section, id="test"):
     default: int = 45
     other: str
 
 
-def _recurse_getitem(obj, segments):
-    new = obj
-    cumulative = []
-    for seg in segments:
-        try:
-            new = new[seg]
-        except IndexError:
-            raise IndexError(*cumulative)
-        cumulative.append(seg)
-    return new
+def _not_found(key: str) -> str:
+    """
+    :return: a reply for an unknown key, suggesting keys it is the start of
+    """
+    similar = config.keys(key)[:10]
+    if not similar:
+        return f"Key '{key}' not found"
+    return f"Key '{key}' not found, did you mean: {', '.join(similar)}"
+
+
+def _parse_value(key, text: str, as_json: bool):
+    """
+    :return: the value of a field given as text, which is JSON unless the
+    field is a string
+    :raises ValueError: if the text should be JSON but isn't
+    """
+    if key.type is str and not as_json:
+        return text
+    try:
+        return json.loads(text)
+    except ValueError:
+        if as_json:
+            raise
+        # e.g. a string for an optional field
+        return text
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, indent=2, ensure_ascii=False, default=str)
 
 
 @bot.command
@@ -35,140 +61,107 @@ class ReloadConfig(BaseCommand):
     name = "reload"
 
     async def callback(self, message: "discord.Message"):
-        config.reload()
-        credentials.reload()
-        await message.channel.send(f"Successfully reloaded config")
+        changed = config.reload() | credentials.reload()
+        await bot.send(
+            message.channel,
+            f"Successfully reloaded config ({len(changed)} sections changed)",
+        )
 
 
 @Config.command
+@require_permission(MANAGE)
 class SetConfig(BaseCommand):
     name = "set"
     help = "sets a config variable"
-    description = "sets a config variable"
-
-    async def initialise(self):
-        self.add_argument("key", required=True)
-        value = self.add_mutually_exclusive_group(required=True)
-        value.add_argument(
-            "--int",
-            "-i",
-            type=int,
-            dest="value",
-            help="specify an integral value",
-        )
-        value.add_argument(
-            "--float",
-            "-f",
-            type=float,
-            dest="value",
-            help="specify a floating-point value",
-        )
-        value.add_argument(
-            "--str", "-s", dest="value", help="specify a string value"
-        )
-        value.add_argument(
-            "--bool",
-            "-b",
-            type=bool,
-            dest="value",
-            help="specify a boolean value",
-        )
-        value.add_argument(
-            "--null",
-            "-n",
-            dest="value",
-            const=None,
-            action="store_const",
-            help="specify a null value",
-        )
-        value.add_argument(
+    description = (
+        "sets a config variable, e.g. 'core.prefix'. The value is JSON, "
+        "unless the variable is a string."
+    )
+
+    def initialise(self):
+        self.add_argument("key")
+        self.add_argument("value")
+        self.add_argument(
             "--json",
             "-j",
-            dest="value",
-            help="specify a value as encoded JSON, e.g."
-                 + r"""```json
-                 {
-                     \"something\": [42, true],
-                     \"escapes\": \"required\",
-                     \"backslash\": \"\\\",
-                     \"unicode\": \"🆗\"
-                 }```""",
+            dest="as_json",
+            action="store_true",
+            help="parse the value as JSON even if the variable is a string, "
+            "e.g. to set it to null",
         )
 
-    # noinspection DuplicatedCode
-    async def callback(self, message: "discord.Message", key, value):
-        *path_segments, name = key.split(".")
-        obj = config
-        cumulative = []
-        for segment in path_segments:
-            cumulative.append(segment)
-            if not isinstance(obj, dict):
-                await message.channel.send(
-                    f"{message.author.mention} Key not found"
-                    + ".".join(cumulative)
-                )
-                return
-            try:
-                obj = obj[segment]
-            except IndexError:
-                await message.channel.send(
-                    f"{message.author.mention} Key not found"
-                    + ".".join(cumulative)
-                )
-                return
+    async def callback(self, message: "discord.Message", key, value, as_json):
+        try:
+            config_key = config.key(key)
+        except KeyError:
+            await bot.send(
+                message.channel, f"{message.author.mention} {_not_found(key)}"
+            )
+            return
         try:
-            setattr(obj, name, value)
-        except pydantic.ValidationError as e:
-            await message.channel.send(
-                f"{message.author.mention} Invalid value '{repr(value)}'"
-                + "\n".join(e.args)
+            value = _parse_value(config_key, value, as_json)
+            config.set(key, value)
+        except ValueError as e:
+            await bot.send(
+                message.channel,
+                f"{message.author.mention} Invalid value for {key} "
+                f"({config_key.type_name}):\n{e}",
             )
             return
-        await message.channel.send()
+        await bot.send(
+            message.channel,
+            f"Set {key} to {json.dumps(config.get(key), default=str)}",
+        )
 
 
 @Config.command
+@cacheable(60.0)
 class ShowConfig(BaseCommand):
     name = "show"
-    help = "shows the value of a config variable"
+    help = "shows the value of a config variable, or of a whole section"
 
-    async def initialise(self):
-        self.add_argument("key", required=True)
+    def initialise(self):
+        self.add_argument("key")
 
-    # noinspection DuplicatedCode
     async def callback(self, message: "discord.Message", key):
-        value = config
-        cumulative = []
-        for segment in key.split("."):
-            cumulative.append(segment)
-            if not isinstance(value, dict):
-                await message.channel.send(
-                    f"{message.author.mention} Key not found"
-                    + ".".join(cumulative)
-                )
-                return
-            try:
-                value = value[segment]
-            except IndexError:
-                await message.channel.send(
-                    f"{message.author.mention} Key not found"
-                    + ".".join(cumulative)
-                )
-                return
-
-        if isinstance(value, dict):
-            await message.channel.send(
-                "object: ```json\n"
-                + json.dumps(value, indent=2, ensure_ascii=False)
-                + "```"
-            )
-        if isinstance(value, list):
-            await message.channel.send(
-                f"{message.author.mention} array:"
-                f"```json\n{json.dumps(value, indent=2, ensure_ascii=False)}```"
-            )
-        else:
-            await message.channel.send(
-                f"{message.author.mention} "
-                f"{type(value).__name__}: {repr(value)}"
-            )
+        try:
+            if "." not in key:
+                section = config.section_instance(key)
+                return f"{key}:```json\n{_dumps(section.dict())}```"
+            config_key = config.key(key)
+            value = config.get(key)
+        except KeyError:
+            return _not_found(key)
+        except ValueError as e:
+            return f"The config of {key.partition('.')[0]} is invalid:\n{e}"
+        return f"{key} ({config_key.type_name}):```json\n{_dumps(value)}```"
+
+
+@Config.command
+@cacheable(60.0)
+class ListConfigKeys(BaseCommand):
+    name = "keys"
+    help = "lists the config variables, and their types"
+
+    def initialise(self):
+        self.add_argument(
+            "prefix", nargs="?", default="", help="e.g. a section, 'core.'"
+        )
+        self.add_argument(
+            "--page", "-p", type=int, default=1, help="the page to show"
+        )
+
+    async def callback(self, message: "discord.Message", prefix, page):
+        keys = config.keys(prefix)
+        if not keys:
+            return f"No config variables start with '{prefix}'"
+        pages = (len(keys) - 1) // KEYS_PAGE_SIZE + 1
+        page = min(max(page, 1), pages)
+        lines = [
+            f"{key} ({config.key(key).type_name})"
+            for key in keys[(page - 1) * KEYS_PAGE_SIZE : page * KEYS_PAGE_SIZE]
+        ]
+        text = "```\n" + "\n".join(lines) + "```"
+        if pages > 1:
+            text += f"page {page}/{pages}"
+        return text
@@ -0,0 +1,120 @@
+import discord
+
+from unibot._globals import bot
+from unibot.command import (
+    BaseCommand,
+    CommandWithSubCommands,
+    require_permission,
+)
+from unibot.permissions import ALL_PERMISSIONS
+
+MANAGE = "permissions.manage"
+
+
+def _add_target_arguments(command: BaseCommand):
+    target = command.add_mutually_exclusive_group(required=True)
+    target.add_argument("--role", "-r", type=int, help="the ID of a role")
+    target.add_argument("--user", "-u", type=int, help="the ID of a user")
+
+
+def _grants(role):
+    """
+    :return: the name of the config field, and a copy of it
+    """
+    config = bot.permissions.config
+    field = "roles" if role is not None else "users"
+    return field, {k: list(v) for k, v in getattr(config, field).items()}
+
+
+@bot.command
+class Permissions(CommandWithSubCommands):
+    name = "permissions"
+    help = "manages the permissions granted to roles and users"
+
+
+@Permissions.command
+@require_permission(MANAGE)
+class GrantPermission(BaseCommand):
+    name = "grant"
+    help = "grants a permission to a role or user"
+
+    def initialise(self):
+        self.add_argument("permission")
+        _add_target_arguments(self)
+
+    async def callback(
+        self, message: "discord.Message", permission, role, user
+    ):
+        field, grants = _grants(role)
+        target = str(role if role is not None else user)
+        granted = grants.setdefault(target, [])
+        if permission not in granted:
+            granted.append(permission)
+            # assign the whole field, so that it is validated and flushed
+            setattr(bot.permissions.config, field, grants)
+            bot.permissions.clear()
+        await bot.send(
+            message.channel, f"Granted '{permission}' to {field[:-1]} {target}"
+        )
+
+
+@Permissions.command
+@require_permission(MANAGE)
+class RevokePermission(BaseCommand):
+    name = "revoke"
+    help = "revokes a permission from a role or user"
+
+    def initialise(self):
+        self.add_argument("permission")
+        _add_target_arguments(self)
+
+    async def callback(
+        self, message: "discord.Message", permission, role, user
+    ):
+        field, grants = _grants(role)
+        target = str(role if role is not None else user)
+        granted = grants.get(target, [])
+        if permission not in granted:
+            await bot.send(
+                message.channel,
+                f"{field[:-1].capitalize()} {target} has not been granted "
+                f"'{permission}'",
+            )
+            return
+        granted.remove(permission)
+        if not granted:
+            del grants[target]
+        setattr(bot.permissions.config, field, grants)
+        bot.permissions.clear()
+        await bot.send(
+            message.channel,
+            f"Revoked '{permission}' from {field[:-1]} {target}",
+        )
+
+
+@Permissions.command
+class ShowPermissions(BaseCommand):
+    name = "show"
+    help = "shows the permissions you, or another member, have"
+
+    def initialise(self):
+        self.add_argument("--user", "-u", type=int, help="the ID of a user")
+
+    async def callback(self, message: "discord.Message", user):
+        if user is None:
+            member = message.author
+        elif message.guild is not None:
+            member = message.guild.get_member(user)
+        else:
+            member = bot.get_user(user)
+        if member is None:
+            await bot.send(message.channel, f"User {user} not found")
+            return
+        permissions = bot.get_user_permissions(member)
+        if permissions is ALL_PERMISSIONS:
+            text = "every permission"
+        elif permissions:
+            text = ", ".join(sorted(permissions))
+        else:
+            text = "no permissions"
+        await bot.send(message.channel, f"{member.display_name} has {text}")
@@ -0,0 +1,83 @@
+import discord
+
+from unibot._globals import bot
+from unibot.command import (
+    BaseCommand,
+    CommandWithSubCommands,
+    require_permission,
+)
+
+MANAGE = "prefixes.manage"
+
+
+def _set_guild_prefixes(guild_id: int, prefixes):
+    """
+    :param prefixes: the guild's prefixes, or None to use the default
+    """
+    guilds = {k: list(v) for k, v in bot.prefixes.config.guilds.items()}
+    if prefixes is None:
+        guilds.pop(str(guild_id), None)
+    else:
+        guilds[str(guild_id)] = prefixes
+    # assign the whole field, so that it is validated and flushed
+    bot.prefixes.config.guilds = guilds
+    bot.prefixes.rebuild()
+
+
+@bot.command
+class Prefix(CommandWithSubCommands):
+    name = "prefix"
+    help = "manages the prefixes of commands in this guild"
+
+
+@Prefix.command
+class ShowPrefix(BaseCommand):
+    name = "show"
+    help = "shows the prefixes of commands in this guild"
+
+    async def callback(self, message: "discord.Message"):
+        guild_id = message.guild.id if message.guild else None
+        prefixes = ", ".join(f"'{p}'" for p in bot.prefixes.get(guild_id))
+        if bot.prefixes.config.mention and bot.user is not None:
+            prefixes += f", {bot.user.mention}"
+        await bot.send(message.channel, f"Prefixes: {prefixes}")
+
+
+@Prefix.command
+@require_permission(MANAGE)
+class SetPrefix(BaseCommand):
+    name = "set"
+    help = "sets the prefixes of commands in this guild"
+
+    def initialise(self):
+        self.add_argument("prefixes", nargs="+")
+
+    async def callback(self, message: "discord.Message", prefixes):
+        if message.guild is None:
+            await bot.send(
+                message.channel, "Prefixes can only be set in guilds"
+            )
+            return
+        _set_guild_prefixes(message.guild.id, prefixes)
+        await bot.send(
+            message.channel,
+            "Prefixes set to " + ", ".join(f"'{p}'" for p in prefixes),
+        )
+
+
+@Prefix.command
+@require_permission(MANAGE)
+class ResetPrefix(BaseCommand):
+    name = "reset"
+    help = "makes this guild use the default prefix"
+
+    async def callback(self, message: "discord.Message"):
+        if message.guild is None:
+            await bot.send(
+                message.channel, "Prefixes can only be set in guilds"
+            )
+            return
+        _set_guild_prefixes(message.guild.id, None)
+        await bot.send(
+            message.channel, f"Prefix reset to '{bot.config.prefix}'"
+        )
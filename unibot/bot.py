@@ -1,7 +1,11 @@
 import asyncio
+import concurrent.futures
+import functools
 import logging
+import multiprocessing
 import shlex
 import sys
+import time
 from pathlib import Path
 from platform import platform
 from typing import *
@@ -10,10 +14,26 @@ import discord
 
 import unibot._globals
 import unibot._utils
+import unibot.cache
 import unibot.config
+import unibot.cooldowns
+import unibot.gateway_log
+import unibot.help
+import unibot.limits
+import unibot.logs
+import unibot.metrics
+import unibot.monitor
+import unibot.outbound
 import unibot.parser
+import unibot.permissions
 import unibot.plugin_manager
+import unibot.prefixes
+import unibot.reactions
+import unibot.router
+import unibot.supervisor
+import unibot.threads
 from unibot import command, __VERSION__
+from unibot.menu import LETTER_EMOJI
 
 EVENT_NAMES = [
     "connect",
@@ -73,12 +93,51 @@ EVENT_NAMES = [
 
 
 class CoreConfig(unibot._globals.config.section, id="core"):
+    # guilds can have their own prefixes, see unibot.prefixes
     prefix: str = "~"
     debug: bool = False
     debug_channel: Optional[str] = None
+    # the minimum level of messages to log, e.g. 'DEBUG' or 'WARNING'
+    log_level: str = "INFO"
     load_base: bool = True
     safe_mode: bool = False
     reconnect: bool = True
+    # reload the config automatically when the file changes
+    watch_config: bool = True
+    # maximum number of commands executing at once, None for no limit
+    max_concurrent_commands_per_guild: Optional[int] = None
+    max_concurrent_commands_per_user: Optional[int] = None
+    # the total number of shards, None for as many as Discord recommends
+    shard_count: Optional[int] = None
+    # the number of processes to split the shards between when run with
+    # `python -m unibot`
+    worker_processes: int = 1
+    # the number of processes for commands' compute steps, None for one per
+    # CPU, and the number of seconds each step may take, None for no limit
+    process_pool_size: Optional[int] = None
+    process_task_timeout: Optional[float] = 60.0
+    # the number of threads for synchronous command callbacks and listeners,
+    # None for the standard library's default
+    thread_pool_size: Optional[int] = None
+    # the maximum number of command results cached, for cacheable commands
+    command_cache_size: int = 1024
+    # 'uvloop', 'asyncio', or 'auto' for uvloop if it is installed. Only
+    # applies when run with `python -m unibot`.
+    event_loop: str = "auto"
+    # seconds of event loop lag which count as a stall, None to not monitor
+    # the loop, and the minimum number of seconds between alerts about
+    # stalls in the debug channel
+    loop_lag_threshold: Optional[float] = 0.25
+    loop_lag_alert_interval: float = 300.0
+    # serve metrics for Prometheus at http://<host>:<port>/metrics, or None
+    # to not serve them. Workers run by the supervisor add the ID of their
+    # first shard to the port.
+    metrics_host: str = "127.0.0.1"
+    metrics_port: Optional[int] = None
+    # record the gateway session to this file, to replay it offline with
+    # benchmarks/replay.py, or None to not record. Record one shard per
+    # process.
+    gateway_record_path: Optional[str] = None
 
 
 class CoreCredentials(unibot._globals.credentials.section, id="core"):
@@ -86,60 +145,155 @@ class CoreCredentials(unibot._globals.credentials.section, id="core"):
     bot_token: str
 
 
-class Bot(discord.Client):
+class Bot(discord.AutoShardedClient):
     FORMAT = "[ {levelname:<7} ] [ {name:<20} ]  {message}"
 
     def __init__(self, config_file="config.json",
-                 credentials_file="credentials.json"):
+                 credentials_file="credentials.json",
+                 shard_ids: Optional[Sequence[int]] = None,
+                 shard_count: Optional[int] = None):
+        """
+        :param shard_ids: the shards to run, by default all of them
+        :param shard_count: the total number of shards, by default that in
+        the config
+        """
         super(Bot, self).__init__()
+        # set after initialising, so that the shard count can come from the
+        # config, which isn't loaded yet
+        self.shard_ids = list(shard_ids) if shard_ids is not None else None
+        self.shard_count = shard_count
 
         self.config: Optional[CoreConfig] = None
         self.credentials: Optional[CoreCredentials] = None
         self.config_file = config_file
         self.credentials_file = credentials_file
 
-        self._listener_coros = {event_name: [] for event_name in EVENT_NAMES}
+        # listeners are stored as tuples, rebuilt on registration, so that
+        # dispatching an event with no listeners costs a single lookup
+        self._listener_coros: Dict[str, Tuple[Callable, ...]] = {}
+        self._inline_listeners: Dict[str, Tuple[Callable, ...]] = {}
+        # listeners which are regular functions, run in the thread pool
+        self._thread_listeners: Dict[str, Tuple[Callable, ...]] = {}
+        # events handled by an on_<event> method, which discord.py dispatches
+        # maps module names to the (event, listener) pairs registered from
+        # them, so that a plugin's listeners can be found when it is unloaded
+        self._listeners_by_module: Dict[str, List[Tuple[str, Callable]]] = {}
+        self._method_events = frozenset(
+            name[3:] for name in dir(type(self)) if name.startswith("on_")
+        )
         self.commands = []
 
         self.logger = logging.getLogger("unibot")
+        # until the configured level is known
         self.logger.setLevel(logging.DEBUG)
-        handler = logging.StreamHandler(sys.stderr)
-        handler.setFormatter(logging.Formatter(self.FORMAT, style="{"))
-        self.logger.addHandler(handler)
+        log_format = self.FORMAT
+        if self.shard_ids is not None:
+            # tell apart the logs of the processes run by the supervisor
+            log_format = (
+                f"[ shards {unibot.supervisor.format_shards(self.shard_ids)} ] "
+                + log_format
+            )
+        self._log_listener = unibot.logs.setup(self.logger, log_format)
 
         self.plugin_manager = unibot.plugin_manager.PluginManager(self)
 
         self.root_parser = unibot.parser.UnibotParser()
         self.subcommands_class = command.CommandWithSubCommands.new("root")
         self.subcommands: Optional[command.CommandWithSubCommands] = None
+        self.router: Optional[unibot.router.CommandRouter] = None
+        self.help_index = unibot.help.HelpIndex(self)
+        self._guild_command_limit = unibot.limits.KeyedSemaphore(None)
+        self._user_command_limit = unibot.limits.KeyedSemaphore(None)
+        self.thread_pool = unibot.threads.ThreadPool()
+        self.command_cache = unibot.cache.TTLCache(1024)
+        self.loop_monitor: Optional[unibot.monitor.LoopMonitor] = None
+        self.metrics = unibot.metrics.BotMetrics(self)
+        self.metrics_server: Optional[unibot.metrics.MetricsServer] = None
+        self.gateway_recorder: Optional[
+            unibot.gateway_log.GatewayRecorder
+        ] = None
+
+        # created by setup(), once the plugins are loaded
+        self.process_pool: Optional[
+            concurrent.futures.ProcessPoolExecutor
+        ] = None
+        # whether plugins have been loaded since the pool was created
+        self._process_pool_stale = False
+
+        self.outbound = unibot.outbound.OutboundScheduler()
+        self.reactions = unibot.reactions.ReactionRouter()
+        self.event_listener("reaction_add", inline=True)(
+            self.reactions.dispatch
+        )
+        self.permissions = unibot.permissions.PermissionEngine()
+        self.event_listener("member_update", inline=True)(
+            self.permissions.on_member_update
+        )
+        self.event_listener("guild_role_update", inline=True)(
+            self.permissions.on_guild_role_update
+        )
+        self.event_listener("guild_role_delete", inline=True)(
+            self.permissions.on_guild_role_delete
+        )
+        self.prefixes = unibot.prefixes.PrefixMatcher()
+        # the bot's user is known from the ready event, which is before the
+        # bot is ready
+        self.event_listener("connect", inline=True)(
+            lambda: self.prefixes.set_user(self.user.id)
+        )
 
         self._planned_disconnect = False
 
-        self.plugin_unload_hooks = [self._recursively_remove_commands]
+        self.plugin_unload_hooks = [self.detach_plugin]
 
         self.global_bot_context = self._GlobalBotContext(self)
 
         @self.event_listener("message")
         async def on_message(message):
-            if message.author == self.user or not message.content.startswith(
-                    self.config.prefix
-            ):
+            self.metrics.messages.inc()
+            guild_id = message.guild.id if message.guild else None
+            length = self.prefixes.match(message.content, guild_id)
+            if not length or message.author == self.user:
                 return
+            self.metrics.prefixed_messages.inc()
             # remove prefix
-            content = message.content[len(self.config.prefix):]
+            content = message.content[length:]
+            # command names don't need quoting, so the command can be found
+            # without tokenizing, to drop calls over a cooldown cheaply
+            found, _ = self.router.find(content.split())
+            if found.cooldowns and unibot.cooldowns.hit(
+                found.cooldowns, message
+            ):
+                self.metrics.cooldowns.inc(found.parser.prog.partition(" ")[2])
+                return
             args = shlex.split(content)
-            self.root_parser.context_message = message
+            unibot.parser.context_message.set(message)
             try:
-                namespace = self.root_parser.parse_args(args)
+                cmd, namespace = self.router.resolve(args)
             except unibot.parser.CommandError:
+                self.metrics.parse_failures.inc()
                 return
-            self.logger.debug(f"Executing command: '{message.content}'")
+            self.logger.debug(
+                "Executing command: '%s'",
+                message.content,
+                extra={"rate_limit": 10},
+            )
+            # the full name of the command, without the root parser's
+            name = cmd.parser.prog.partition(" ")[2]
+            self.metrics.commands.inc(name)
+            start = time.perf_counter()
             try:
-                await self.subcommands(message, **vars(namespace))
+                async with self._guild_command_limit.acquire(
+                    guild_id
+                ), self._user_command_limit.acquire(message.author.id):
+                    await cmd(message, namespace)
             except Exception as e:
-                await message.exception_handler(e, message)
+                self.metrics.exceptions.inc("command")
+                await self.exception_handler(e, message)
             finally:
-                self.root_parser.context_message = None
+                self.metrics.command_latency.observe(
+                    time.perf_counter() - start, name
+                )
 
         @self.event_listener("ready")
         async def on_ready():
@@ -154,15 +308,20 @@ class Bot(discord.Client):
 
     async def exception_handler(self, e, message):
         self.logger.error(
-            f"Exception in command '{message.content}'", exc_info=e
+            "Exception in command %r", message.content, exc_info=e
         )
         if self.config.debug:
             import traceback
 
             tb = traceback.format_exc()
-            await message.channel.send(f"Error:\n```{tb}```")
+            await self.send(
+                message.channel,
+                f"Error:\n```{tb}```",
+                priority=unibot.outbound.Priority.DIAGNOSTIC,
+            )
         else:
-            await message.channel.send(
+            await self.send(
+                message.channel,
                 "Oops! An error occurred while executing your command."
                 "Please contact the server administrator. If you are"
                 "the bot administrator, check the server logs"
@@ -171,9 +330,89 @@ class Bot(discord.Client):
                     if self.config.debug_channel
                     else ""
                 )
-                + " for more details."
+                + " for more details.",
+                priority=unibot.outbound.Priority.DIAGNOSTIC,
+            )
+
+    def get_debug_channel(self) -> Optional[discord.abc.Messageable]:
+        """
+        :return: the channel set as config.debug_channel, by ID or name, or
+        None if it isn't set or can't be found
+        """
+        name = self.config.debug_channel
+        if not name:
+            return None
+        if name.isdigit():
+            return self.get_channel(int(name))
+        return discord.utils.get(self.get_all_channels(), name=name)
+
+    def _alert_loop_stalled(self, text: str):
+        channel = self.get_debug_channel()
+        if channel is not None:
+            self.send(
+                channel,
+                f"```\n{text}```",
+                priority=unibot.outbound.Priority.DIAGNOSTIC,
             )
 
+    def send(
+        self, channel: discord.abc.Messageable, content=None, **kwargs
+    ) -> "asyncio.Future[discord.Message]":
+        """
+        queues a message to be sent. Use this rather than channel.send, so
+        that messages are rate limited and prioritised.
+        See `unibot.outbound.OutboundScheduler.send`.
+        """
+        return self.outbound.send(channel, content, **kwargs)
+
+    def get_user_permissions(
+        self, user: Union[discord.User, discord.Member]
+    ) -> FrozenSet[str]:
+        """
+        :return: the bot permissions granted to a user, or to a member in
+        their guild. See `unibot.permissions.PermissionEngine.get`.
+        """
+        return self.permissions.get(user)
+
+    async def offload(self, fn: Callable, *args, **kwargs):
+        """
+        runs a CPU-bound function in the process pool, so that it doesn't
+        block the event loop. The function, its arguments and its result must
+        be picklable.
+        :return: the result of the function
+        :raises asyncio.TimeoutError: if it takes longer than
+        config.process_task_timeout. The function keeps running in its
+        process, but its result is discarded.
+        """
+        loop = asyncio.get_event_loop()
+        if self._process_pool_stale:
+            # recreated here rather than when plugins are loaded, so that
+            # importing lazy plugins doesn't fork a process per CPU each time
+            old = self.process_pool
+            self.start_process_pool()
+            loop.run_in_executor(None, old.shutdown)
+        future = loop.run_in_executor(
+            self.process_pool, functools.partial(fn, *args, **kwargs)
+        )
+        return await asyncio.wait_for(future, self.config.process_task_timeout)
+
+    def start_process_pool(self):
+        """
+        creates the process pool used by offload(), and starts its processes.
+        Plugins are loaded from paths rather than imported, so the processes
+        are forked to inherit them.
+        """
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = None
+        self.process_pool = concurrent.futures.ProcessPoolExecutor(
+            self.config.process_pool_size, mp_context=context
+        )
+        self._process_pool_stale = False
+        # the first call starts every process
+        self.process_pool.submit(int)
+
     async def ask_question(
             self,
             channel: discord.TextChannel,
@@ -181,28 +420,51 @@ class Bot(discord.Client):
             options,
             target_user,
             reaction_emoji=LETTER_EMOJI,
+            timeout=None,
     ):
+        """
+        asks a user to choose an option by reacting to a message
+        :param timeout: how many seconds to wait for a choice, or None to wait
+        forever
+        :return: the chosen option
+        :raises asyncio.TimeoutError: if no option is chosen in time
+        """
         if len(options) > len(reaction_emoji):
             raise ValueError("too many options")
         text = question + "\n" + "\n".join(map(" ".join,
                                                zip(reaction_emoji, options)))
+        emoji = reaction_emoji[: len(options)]
 
-        def check(m):
-            return m.author == target_user
+        def check(reaction, user):
+            return user == target_user and reaction.emoji in emoji
 
-        message = await channel.send(text)
-        await asyncio.gather(
-            [
-                message.add_reaction(emoji)
-                for emoji in reaction_emoji[: len(options) - 1]
-            ]
-        )
-        reaction = await self.wait_for("reaction_add", check=check)
+        message = await self.send(channel, text, merge=False)
+        with self.reactions.watch(message, check, timeout) as route:
+            await asyncio.gather(
+                *(self.outbound.add_reaction(message, e) for e in emoji)
+            )
+            reaction, _ = await route.get()
+        return options[emoji.index(reaction.emoji)]
 
     async def close(self):
         self.logger.info("Logging out")
         self._planned_disconnect = True
-        return super(Bot, self).close()
+        self.outbound.close()
+        self.reactions.close()
+        if self.process_pool is not None:
+            # waiting, as the pool fails at exit if it is still shutting down
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.process_pool.shutdown
+            )
+        self.thread_pool.close()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        await super(Bot, self).close()
+        unibot._globals.config.unwatch()
+        await unibot._globals.config.flushed()
+        await unibot._globals.credentials.flushed()
 
     def event(self, coro):
         raise NotImplementedError(
@@ -210,35 +472,243 @@ class Bot(discord.Client):
             "Use the @event_listener decorator instead"
         )
 
-    def event_listener(self, name: str):
+    def event_listener(self, name: str, inline: bool = False):
+        """
+        registers a listener for an event
+        :param name: the name of the event, without the 'on_' prefix
+        :param inline: if True, the listener is a regular function which is
+        called directly when the event is dispatched, rather than in a new
+        task. Only use this for listeners which are quick and never block.
+        Other listeners which are regular functions are run in the thread
+        pool.
+        """
         if name not in EVENT_NAMES:
             raise ValueError(f"no such event '{name}'")
 
-        def decorator(coro: Coroutine):
-            self._listener_coros[name].append(coro)
-            return coro
+        def decorator(fn: Callable):
+            if inline:
+                if asyncio.iscoroutinefunction(fn):
+                    raise TypeError("inline listeners cannot be coroutines")
+                listeners = self._inline_listeners
+            elif asyncio.iscoroutinefunction(fn):
+                listeners = self._listener_coros
+            else:
+                listeners = self._thread_listeners
+            listeners[name] = (*listeners.get(name, ()), fn)
+            self._listeners_by_module.setdefault(fn.__module__, []).append(
+                (name, fn)
+            )
+            return fn
 
         return decorator
 
+    def remove_event_listener(self, name: str, fn: Callable):
+        for listeners in (
+            self._listener_coros,
+            self._inline_listeners,
+            self._thread_listeners,
+        ):
+            remaining = tuple(l for l in listeners.get(name, ()) if l is not fn)
+            if remaining:
+                listeners[name] = remaining
+            else:
+                listeners.pop(name, None)
+        owned = self._listeners_by_module.get(fn.__module__)
+        if owned and (name, fn) in owned:
+            owned.remove((name, fn))
+
     def dispatch(self, event, *args, **kwargs):
-        for listener in self._listener_coros.get(event, []):
-            asyncio.create_task(listener(*args, **kwargs))
-        return super(Bot, self).dispatch(event, *args, **kwargs)
+        self.metrics.events.inc(event)
+        self._dispatch_listeners(event, args, kwargs)
+        # discord.py only needs the event for wait_for() and on_<event>
+        # methods, so skip its overhead if there are neither
+        if event in self._listeners or event in self._method_events:
+            super(Bot, self).dispatch(event, *args, **kwargs)
+
+    def _dispatch_listeners(self, event, args, kwargs, only=None):
+        """
+        calls the listeners for an event
+        :param only: if given, the listeners to call, skipping the others
+        """
+        listeners = self._inline_listeners.get(event)
+        if listeners is not None:
+            for listener in listeners:
+                if only is not None and listener not in only:
+                    continue
+                timings = self.plugin_manager.stats_for(
+                    listener.__module__
+                ).listeners
+                start = timings.start()
+                failed = False
+                try:
+                    listener(*args, **kwargs)
+                except Exception as e:
+                    failed = True
+                    self.metrics.exceptions.inc("listener")
+                    self.logger.error(
+                        "Exception in listener for event '%s'",
+                        event,
+                        exc_info=e,
+                    )
+                timings.finish(start, failed)
+        listeners = self._listener_coros.get(event)
+        if listeners is not None:
+            for listener in listeners:
+                if only is not None and listener not in only:
+                    continue
+                asyncio.create_task(
+                    self._run_listener(event, listener, args, kwargs)
+                )
+        listeners = self._thread_listeners.get(event)
+        if listeners is not None:
+            for listener in listeners:
+                if only is not None and listener not in only:
+                    continue
+                asyncio.create_task(
+                    self._run_listener(
+                        event, listener, args, kwargs, threaded=True
+                    )
+                )
+
+    async def _run_listener(
+        self, event, listener, args, kwargs, threaded=False
+    ):
+        timings = self.plugin_manager.stats_for(listener.__module__).listeners
+        start = timings.start()
+        failed = False
+        try:
+            if threaded:
+                await self.thread_pool.run(listener, *args, **kwargs)
+            else:
+                await listener(*args, **kwargs)
+        except Exception as e:
+            failed = True
+            self.metrics.exceptions.inc("listener")
+            self.logger.error(
+                "Exception in listener for event '%s'", event, exc_info=e
+            )
+        finally:
+            timings.finish(start, failed)
 
     def plugin_unload_hook(self, fn):
         self.plugin_unload_hooks.append(fn)
 
-    def _recursively_remove_commands(self, plugin, subcommands=None):
-        subcommands = subcommands or self.subcommands
-        for i, cmd in enumerate(subcommands.commands):
-            if cmd.__module__ is plugin:
-                del subcommands.commands[i]
-            elif isinstance(command, unibot.command.CommandWithSubCommands):
-                self._recursively_remove_commands(plugin, cmd)
+    def attach_plugin(self, plugin):
+        """
+        adds the commands registered by a plugin to the command tree, for
+        plugins loaded after the tree was built
+        """
+        registered = command.CommandWithSubCommands.registered
+        for module in self._plugin_modules(plugin, registered):
+            for group_class, cmd in registered[module]:
+                self.add_command(group_class, cmd)
+        # the pool's processes don't have the plugin's new code
+        self._process_pool_stale = self.process_pool is not None
+
+    def detach_plugin(self, plugin):
+        """
+        removes the commands and listeners registered by a plugin, including
+        those registered from its submodules
+        """
+        registered = command.CommandWithSubCommands.registered
+        for module in self._plugin_modules(
+            plugin, {*registered, *self._listeners_by_module}
+        ):
+            for group_class, cmd in registered.pop(module, ()):
+                self.remove_command(group_class, cmd)
+            for event, listener in self._listeners_by_module.pop(module, ()):
+                self.remove_event_listener(event, listener)
+        # the keys start with the command's class
+        self.command_cache.invalidate(
+            lambda key: self._plugin_modules(plugin, [key[0].__module__])
+        )
+
+    @staticmethod
+    def _plugin_modules(plugin, modules: Iterable[str]) -> List[str]:
+        """
+        :return: the modules which are the plugin itself or its submodules
+        """
+        prefix = plugin.__name__ + "."
+        return [
+            module
+            for module in modules
+            if module == plugin.__name__ or module.startswith(prefix)
+        ]
+
+    def add_command(
+        self,
+        group_class: Type[command.CommandWithSubCommands],
+        cmd: Type[command.BaseCommand],
+    ):
+        """
+        adds a command registered in a command group to the command tree, if
+        the tree has been built and the group is in it. Only the group's own
+        parser is changed.
+        """
+        group = self.router and self.router.find_group(group_class)
+        if group:
+            instance = group.add_command(cmd)
+            if instance is not None:
+                self.router.add(group, instance)
+                self.help_index.invalidate()
+
+    def remove_command(
+        self,
+        group_class: Type[command.CommandWithSubCommands],
+        cmd: Type[command.BaseCommand],
+    ):
+        """
+        removes a command from a command group, and from the command tree.
+        Only the group's own parser is changed.
+        """
+        if cmd in group_class.commands:
+            group_class.commands.remove(cmd)
+        group = self.router and self.router.find_group(group_class)
+        if group and type(group._commands_callbacks.get(cmd.name)) is cmd:
+            group.remove_command(cmd.name)
+            self.router.remove(group, cmd.name)
+            self.help_index.invalidate()
 
     def command(self, cls):
         return self.subcommands_class.command(cls)
 
+    def rebuild_commands(self):
+        """
+        rebuilds the parsers and router from the registered commands, after
+        commands have been added or removed
+        """
+        self.root_parser = unibot.parser.UnibotParser()
+        self.subcommands = self.subcommands_class(self.root_parser)
+        self.router = unibot.router.CommandRouter(self.subcommands)
+        self.help_index.invalidate()
+
+    def _start_metrics_server(self, loop: asyncio.AbstractEventLoop):
+        port = self.config.metrics_port
+        if self.shard_ids is not None:
+            port += self.shard_ids[0]
+        self.metrics_server = unibot.metrics.MetricsServer(
+            self.metrics, self.config.metrics_host, port
+        )
+        try:
+            loop.run_until_complete(self.metrics_server.start())
+        except OSError as e:
+            # metrics aren't worth failing to start over
+            self.logger.error(
+                "Failed to serve metrics on port %s", port, exc_info=e
+            )
+            loop.run_until_complete(self.metrics_server.close())
+            self.metrics_server = None
+
+    def _start_gateway_recorder(self):
+        self.gateway_recorder = unibot.gateway_log.GatewayRecorder(
+            self.config.gateway_record_path, self.credentials.bot_token
+        )
+        for event in ("socket_raw_receive", "socket_raw_send", "disconnect"):
+            self.event_listener(event, inline=True)(
+                getattr(self.gateway_recorder, f"on_{event}")
+            )
+        self.gateway_recorder.start()
+
     def generate_add_url(self):
         return (
             "https://discordapp.com/oauth2/authorize?&client_id="
@@ -256,37 +726,91 @@ class Bot(discord.Client):
         def __exit__(self, exc_type, exc_val, exc_tb):
             unibot._globals.bot = None
 
+    def setup(self):
+        """
+        loads the config and plugins, and builds the command tree, without
+        connecting to Discord. run() does this first; to use the bot offline,
+        e.g. in benchmarks, call it directly within global_bot_context.
+        """
+        self.logger.info("Loading config.")
+        unibot._globals.config.load(Path(self.config_file))
+        self.config = CoreConfig()
+        unibot._globals.credentials.load(Path(self.credentials_file))
+        self.credentials = CoreCredentials()
+        unibot.logs.set_level(self.logger, self.config.log_level)
+        unibot._globals.config.subscribe(
+            "core",
+            lambda config: unibot.logs.set_level(self.logger, config.log_level),
+        )
+        unibot._globals.config.subscribe(
+            "core", lambda config: self.prefixes.set_default(config.prefix)
+        )
+        if self.shard_count is None:
+            self.shard_count = self.config.shard_count
+        if self.shard_ids is not None and self.shard_count is None:
+            raise ValueError("shard_count is needed to run some shards")
+        self._guild_command_limit = unibot.limits.KeyedSemaphore(
+            self.config.max_concurrent_commands_per_guild
+        )
+        self._user_command_limit = unibot.limits.KeyedSemaphore(
+            self.config.max_concurrent_commands_per_user
+        )
+        self.thread_pool = unibot.threads.ThreadPool(
+            self.config.thread_pool_size
+        )
+        self.command_cache = unibot.cache.TTLCache(
+            self.config.command_cache_size
+        )
+        # cached results may depend on any of the config
+        unibot._globals.config.subscribe(
+            None, lambda config: self.command_cache.clear()
+        )
+        self.permissions.load()
+        self.prefixes.load(self.config.prefix)
+        self.plugin_manager.load_config()
+        if self.config.load_base:
+            self.logger.info("Loading base.")
+            from unibot import base
+
+            self.plugin_manager.plugins["unibot.base"] = base
+        if self.config.safe_mode:
+            self.logger.info("Skipping loading plugins (safe mode enabled).")
+        else:
+            self.logger.info("Loading plugins.")
+            self.plugin_manager.load_plugins()
+        self.rebuild_commands()
+        # before any other threads are started, which forked processes could
+        # inherit held locks from
+        self.start_process_pool()
+
     def run(self):
         with self.global_bot_context:
             self.logger.info("Starting bot.")
-            self.logger.debug(f"Unibot version: {__VERSION__:08x}")
-            self.logger.debug(f"Python version: {sys.hexversion:08x}")
-            self.logger.debug(f"Platform: {platform()}")
-            self.logger.info("Loading config.")
-            self.config = self.config.load(Path(self.config_file))
-            self.credentials = unibot._globals.credentials.load(
-                Path(self.credentials_file)
-            )
-            if self.config.load_base:
-                self.logger.info("Loading base.")
-                from unibot import base
-
-                self.plugin_manager.plugins["unibot.base"] = base
-            if self.config.safe_mode:
-                self.logger.info("Skipping loading plugins (safe mode "
-                                 "enabled).")
-                return
-            else:
-                self.logger.info("Loading plugins.")
-                self.plugin_manager.load_plugins()
-            self.subcommands = self.subcommands_class(self.root_parser)
+            self.logger.debug("Unibot version: %08x", __VERSION__)
+            self.logger.debug("Python version: %08x", sys.hexversion)
+            self.logger.debug("Platform: %s", platform())
+            self.setup()
             self.logger.info("Logging in.")
 
             loop = asyncio.get_event_loop()
+            self.logger.debug("Event loop: %s", type(loop).__module__)
             if sys.version_info < (3, 7, 4):
                 # a bug between python 3.7 and 3.7.3 causes some weird SSL error
                 # which causes crashes (see docstring)
                 unibot._utils.ignore_aiohttp_ssl_error(loop)
+            if self.config.watch_config:
+                unibot._globals.config.watch()
+            if self.config.loop_lag_threshold is not None:
+                self.loop_monitor = unibot.monitor.LoopMonitor(
+                    self.config.loop_lag_threshold,
+                    self.config.loop_lag_alert_interval,
+                    self._alert_loop_stalled,
+                )
+                self.loop_monitor.start(loop)
+            if self.config.metrics_port is not None:
+                self._start_metrics_server(loop)
+            if self.config.gateway_record_path is not None:
+                self._start_gateway_recorder()
             try:
                 loop.run_until_complete(
                     self.start(self.credentials.bot_token,
@@ -297,4 +821,11 @@ class Bot(discord.Client):
             # cancel all tasks lingering
             finally:
                 self.logger.info("Shutting down.")
+                # in case the loop stopped before close() was called
+                unibot._globals.config.flush()
+                unibot._globals.credentials.flush()
                 loop.close()
+                if self.gateway_recorder is not None:
+                    self.gateway_recorder.stop()
+                # write out the remaining logs
+                self._log_listener.stop()
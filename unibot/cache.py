@@ -0,0 +1,69 @@
+"""
+a bounded cache of command results.
+
+Entries expire after their own time to live, and the least recently used are
+evicted when the cache is full. Expired entries are only dropped when they
+are looked up or evicted, so the cache costs nothing between commands.
+"""
+
+import collections
+import time
+from typing import *
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, size: int):
+        """
+        :param size: the maximum number of entries
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # (expiry time by time.monotonic, value), least recently used first
+        self._entries: (
+            "collections.OrderedDict[Hashable, Tuple[float, Any]]"
+        ) = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default=None):
+        """
+        :return: the value cached for a key, or default if it isn't cached or
+        has expired
+        """
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value, ttl: float):
+        """
+        :param ttl: the number of seconds to keep the value for
+        """
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]):
+        """
+        removes the entries whose keys match a predicate
+        """
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
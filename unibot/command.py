@@ -1,30 +1,101 @@
+import asyncio
 from typing import *
 
-from unibot import bot
+import unibot._globals
+import unibot.cooldowns
+from unibot.parser import context_message
 
 if TYPE_CHECKING:
     import argparse
 
 _SUBCOMMAND_DEST_PREFIX = "_subcommand_"
 
+_MISSING = object()
+
+CACHE_SCOPES = ("user", "channel", "guild")
+
 
 def require_permission(name):
     def decorator(cls: "BaseCommand"):
-        cls.required_permissions.append(name)
+        # copy, so that the list isn't shared with the base class
+        cls.required_permissions = [*cls.required_permissions, name]
+        return cls
+
+    return decorator
+
+
+def cooldown(rate: int, per: float, scope: str = "user"):
+    """
+    limits a command to `rate` calls every `per` seconds for each user,
+    channel or guild. See `unibot.cooldowns.Cooldown`.
+    """
+
+    def decorator(cls: "BaseCommand"):
+        cls.cooldowns = [
+            *cls.cooldowns,
+            unibot.cooldowns.Cooldown(rate, per, scope),
+        ]
         return cls
 
     return decorator
 
 
+def cacheable(ttl: float, scope: Optional[str] = None):
+    """
+    caches the result of a command for calls with the same arguments. Its
+    callback must return its reply, rather than sending it, so that the reply
+    can be sent again from the cache.
+    :param ttl: the number of seconds to keep results for
+    :param scope: 'user', 'channel' or 'guild' if the result also depends on
+    which one the command was called from, otherwise None
+    """
+    if scope is not None and scope not in CACHE_SCOPES:
+        raise ValueError(f"Invalid cache scope '{scope}'")
+
+    def decorator(cls: "BaseCommand"):
+        cls.cache_ttl = ttl
+        cls.cache_scope = scope
+        return cls
+
+    return decorator
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
 class BaseCommand:
     name: str
     help: Optional[str] = None
     description: Optional[str] = None
     required_permissions: Sequence[str] = []
+    # rate limits, checked before the arguments are parsed. Calls over a
+    # limit are dropped. Add them with the cooldown decorator.
+    cooldowns: Sequence[unibot.cooldowns.Cooldown] = []
+    # a CPU-bound step, run in the bot's process pool with the parsed
+    # arguments before the callback, which is then called with its result
+    # instead. It must be a module-level function or a staticmethod, and its
+    # arguments and result must be picklable.
+    compute: Optional[Callable[..., Any]] = None
+    # a callback which is a regular function is run in the bot's thread pool,
+    # unless this is True, in which case it must be quick and never block. As
+    # it can't send messages itself, any text it returns is sent as a reply.
+    run_inline: bool = False
+    # how long results are cached for, and what else they depend on besides
+    # the arguments. Set them with the cacheable decorator.
+    cache_ttl: Optional[float] = None
+    cache_scope: Optional[str] = None
     callback: Callable[..., None]
 
     def __init__(self, parser: "argparse.ArgumentParser"):
         self.parser = parser
+        self._coroutine_callback = asyncio.iscoroutinefunction(
+            getattr(self, "callback", None)
+        )
         if not isinstance(self, CommandWithSubCommands):
             self.initialise()
 
@@ -56,17 +127,94 @@ class BaseCommand:
         # here is where subclasses should add arguments
         ...
 
-    def __call__(self, message, namespace):
-        for permission in self.required_permissions:
-            if permission not in bot.get_user_permissions(message.author):
-                message.add_reaction("⛔⛔⛔⛔⛔⛔🚫\N{prohibited sign}")
-                message.channel.send(
-                    f"{message.author.mention} "
-                    f"You do not have the required permission '{permission}' "
-                    "to execute this command"
-                )
-                return
-        return self.callback(message, **vars(namespace))
+    def parse_args(self, args: Sequence[str]) -> "argparse.Namespace":
+        """
+        parses the arguments to this command, not including its name
+        """
+        return self.parser.parse_args(args)
+
+    async def __call__(self, message, namespace):
+        bot = unibot._globals.bot
+        token = context_message.set(message)
+        timings = bot.plugin_manager.stats_for(type(self).__module__).commands
+        start = timings.start()
+        failed = True
+        try:
+            if self.required_permissions:
+                # only looked up when needed, so that the users who never run
+                # such commands don't take up the permission engine's cache
+                permissions = bot.get_user_permissions(message.author)
+                for permission in self.required_permissions:
+                    if permission not in permissions:
+                        bot.outbound.add_reaction(
+                            message, "\N{prohibited sign}"
+                        )
+                        await bot.send(
+                            message.channel,
+                            f"{message.author.mention} "
+                            f"You do not have the required permission "
+                            f"'{permission}' to execute this command",
+                        )
+                        failed = False
+                        return
+            key = None
+            if self.cache_ttl is not None:
+                key = self._cache_key(message, namespace)
+            if key is not None:
+                result = bot.command_cache.get(key, _MISSING)
+                if result is not _MISSING:
+                    if isinstance(result, str):
+                        await bot.send(message.channel, result)
+                    failed = False
+                    return result
+            if self.compute is not None:
+                computed = await bot.offload(self.compute, **vars(namespace))
+                result = await self._callback(message, computed)
+            else:
+                result = await self._callback(message, **vars(namespace))
+            if key is not None:
+                bot.command_cache.put(key, result, self.cache_ttl)
+            failed = False
+            return result
+        finally:
+            timings.finish(start, failed)
+            context_message.reset(token)
+
+    def _cache_key(self, message, namespace) -> Optional[Hashable]:
+        """
+        :return: the key of the result of a call in the bot's command cache,
+        or None if the arguments can't be part of one
+        """
+        scope = None
+        if self.cache_scope == "user":
+            scope = message.author.id
+        elif self.cache_scope == "guild" and message.guild is not None:
+            scope = message.guild.id
+        elif self.cache_scope is not None:
+            scope = message.channel.id
+        key = (type(self), scope, _freeze(sorted(vars(namespace).items())))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    async def _callback(self, message, *args, **kwargs):
+        bot = unibot._globals.bot
+        if self._coroutine_callback:
+            result = await self.callback(message, *args, **kwargs)
+            # only cached coroutine callbacks return their reply
+            if self.cache_ttl is None:
+                return result
+        elif self.run_inline:
+            result = self.callback(message, *args, **kwargs)
+        else:
+            result = await bot.thread_pool.run(
+                self.callback, message, *args, **kwargs
+            )
+        if isinstance(result, str):
+            await bot.send(message.channel, result)
+        return result
 
 
 class CommandWithSubCommands(BaseCommand):
@@ -76,12 +224,26 @@ class CommandWithSubCommands(BaseCommand):
     metavar: Optional[str] = None
 
     commands: List[Type[BaseCommand]] = []
+    # maps module names to the (command group, command) pairs registered from
+    # them, so that a plugin's commands can be found when it is unloaded
+    registered: Dict[
+        str, List[Tuple[Type["CommandWithSubCommands"], Type[BaseCommand]]]
+    ] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super(CommandWithSubCommands, cls).__init_subclass__(**kwargs)
+        # each command group needs its own list of commands
+        cls.commands = []
 
     @classmethod
     def command(cls, command):
         if isinstance(command, CommandWithSubCommands):
             command._depth += 1
         cls.commands.append(command)
+        CommandWithSubCommands.registered.setdefault(
+            command.__module__, []
+        ).append((cls, command))
+        return command
 
     def __init__(self, parser):
         super(CommandWithSubCommands, self).__init__(parser)
@@ -99,8 +261,32 @@ class CommandWithSubCommands(BaseCommand):
 
         self._commands_callbacks = {}
         for command in self.commands:
-            new = self.subparsers.add_parser(command.name)
-            self._commands_callbacks[command.name] = command(new)
+            self.add_command(command)
+
+    def add_command(self, command: Type[BaseCommand]) -> Optional[BaseCommand]:
+        """
+        adds a subcommand to this command's parser
+        :return: the new subcommand, or None if there already is a subcommand
+        with the same name
+        """
+        if command.name in self._commands_callbacks:
+            return None
+        new = self.subparsers.add_parser(command.name)
+        instance = self._commands_callbacks[command.name] = command(new)
+        return instance
+
+    def remove_command(self, name: str):
+        """
+        removes a subcommand from this command's parser
+        """
+        del self._commands_callbacks[name]
+        # argparse has no public way to remove a subparser
+        del self.subparsers._name_parser_map[name]
+        self.subparsers._choices_actions = [
+            action
+            for action in self.subparsers._choices_actions
+            if action.dest != name
+        ]
 
     def callback(self, message, **kwargs):
         command_name = kwargs.pop(self._dest)
@@ -1,21 +1,73 @@
+import asyncio
+import bisect
+import itertools
 import json
+import logging
 import pathlib
-from typing import Optional
+from typing import *
 
 from pydantic import BaseModel, BaseConfig
 
+import unibot._utils
+from unibot.watcher import FileWatcher
+
+
+class ConfigKey(NamedTuple):
+    """
+    a field of a config section, by its dotted path, e.g. 'core.prefix'
+    """
+
+    path: str
+    section: str
+    field: str
+    type: Any
+
+    @property
+    def type_name(self) -> str:
+        if isinstance(self.type, type):
+            return self.type.__name__
+        return str(self.type).replace("typing.", "")
+
+
+_MISSING = object()
+
 
 class Config:
     """
     config with sub-configuration sections
     """
 
-    def __init__(self):
+    def __init__(self, flush_delay: float = 1.0):
+        """
+        :param flush_delay: how long to wait after a change before writing the
+        config file, so that many changes are written at once
+        """
         self.path: Optional[pathlib.Path] = None
+        self.flush_delay = flush_delay
+        self.logger = logging.getLogger("unibot.config")
+        self._dirty = False
+        # fields changed since the last write, by section, with MISSING for
+        # those deleted, which are kept when the file is reloaded
+        self._unflushed: Dict[str, Dict[str, Any]] = {}
+        # the same, for the changes being written
+        self._writing: Dict[str, Dict[str, Any]] = {}
+        # the (mtime, size, inode) of the file after the last write, so that
+        # the watcher can ignore the bot's own writes
+        self._written: Optional[Tuple[int, int, int]] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_requested: Optional[asyncio.Event] = None
         self._section_data_raw = {}
         self._section_data = {}
         self._section_classes = {}
         self._section_instances = {}
+        # every field of every section, by its dotted path, and the paths in
+        # order for finding them by prefix
+        self._keys: Dict[str, ConfigKey] = {}
+        self._sorted_keys: List[str] = []
+        self._subscribers: Dict[
+            Optional[str], List[Callable[[BaseModel], Any]]
+        ] = {}
+        self._watcher: Optional[FileWatcher] = None
 
         self_outer = self
 
@@ -27,6 +79,7 @@ class Config:
             def __init_subclass__(cls, id: str):
                 self._section_classes[id] = cls
                 cls.__config_name__ = id
+                self._index(id, cls)
 
             def __init__(self):
                 data = self_outer._section_data[self.__config_name__]
@@ -36,18 +89,29 @@ class Config:
             def unload(self):
                 del self_outer._section_instances[self.__config_name__]
                 del self_outer._section_classes[self.__config_name__]
+                self_outer._unindex(self.__config_name__)
 
             def __setattr__(self, key, value):
                 super(Section, self).__setattr__(key, value)
-                self_outer._section_data_raw[self.__config_name__][key] = value
+                self_outer._section_data_raw.setdefault(
+                    self.__config_name__, {}
+                )[key] = value
+                self_outer._unflushed.setdefault(self.__config_name__, {})[
+                    key
+                ] = value
                 self_outer.flush_config()
+                self_outer._notify(self.__config_name__)
 
             __setitem__ = __setattr__
 
             def __delattr__(self, item):
                 super(Section, self).__delattr__(item)
                 del self_outer._section_data_raw[self.__config_name__][item]
+                self_outer._unflushed.setdefault(self.__config_name__, {})[
+                    item
+                ] = _MISSING
                 self_outer.flush_config()
+                self_outer._notify(self.__config_name__)
 
             __delitem__ = __delattr__
 
@@ -59,26 +123,298 @@ class Config:
 
         self.section = Section
 
-    def reload(self):
-        for k in self._section_data:
-            if k not in self._section_instances:
-                # has not yet been initialised - new plugin?
-                self._section_instances[k] = self._section_classes[k]()
-            else:
-                # needs reinitialising
-                self._section_instances[k].__init__()
+    def _index(self, id: str, cls: Type[BaseModel]):
+        # a section may be redefined, e.g. when its plugin is reloaded
+        self._unindex(id)
+        try:
+            hints = get_type_hints(cls)
+        except Exception:
+            # e.g. unresolved forward references
+            hints = {}
+        for name, field in cls.__fields__.items():
+            path = f"{id}.{name}"
+            self._keys[path] = ConfigKey(
+                path, id, name, hints.get(name, field.type_)
+            )
+            bisect.insort(self._sorted_keys, path)
+
+    def _unindex(self, id: str):
+        prefix = id + "."
+        paths = self.keys(prefix)
+        for path in paths:
+            del self._keys[path]
+        start = bisect.bisect_left(self._sorted_keys, prefix)
+        del self._sorted_keys[start : start + len(paths)]
+
+    def key(self, path: str) -> ConfigKey:
+        """
+        :param path: the dotted path of a field, e.g. 'core.prefix'
+        :raises KeyError: if there is no such field
+        """
+        return self._keys[path]
+
+    def keys(self, prefix: str = "") -> List[str]:
+        """
+        :return: the dotted paths of every field which start with a prefix,
+        in order
+        """
+        start = bisect.bisect_left(self._sorted_keys, prefix)
+        return list(
+            itertools.takewhile(
+                lambda path: path.startswith(prefix),
+                itertools.islice(self._sorted_keys, start, None),
+            )
+        )
+
+    def section_instance(self, id: str) -> BaseModel:
+        """
+        :return: the instance of a section, creating it if it hasn't been yet
+        :raises KeyError: if there is no such section
+        :raises ValueError: if the section's config is invalid
+        """
+        section = self._section_instances.get(id)
+        if section is None:
+            cls = self._section_classes[id]
+            self._section_data.setdefault(
+                id, self._section_data_raw.get(id, {})
+            )
+            section = cls()
+        return section
+
+    def get(self, path: str):
+        """
+        :return: the value of a field by its dotted path
+        :raises KeyError: if there is no such field
+        :raises ValueError: if the field's section is invalid
+        """
+        key = self._keys[path]
+        return getattr(self.section_instance(key.section), key.field)
+
+    def set(self, path: str, value):
+        """
+        validates and assigns a value to a field by its dotted path
+        :raises KeyError: if there is no such field
+        :raises ValueError: if the value, or the field's section, is invalid
+        """
+        key = self._keys[path]
+        setattr(self.section_instance(key.section), key.field, value)
+
+    def reload(self) -> Set[str]:
+        """
+        re-reads the config file, and re-validates only the sections whose
+        data has changed. Subscribers to those sections are then notified.
+        Changes which haven't been written to the file yet are kept.
+        :return: the IDs of the sections which changed
+        """
+        with self.path.open("r") as f:
+            data_raw = json.load(f)
+        for changes in (self._writing, self._unflushed):
+            for key, fields in changes.items():
+                section = data_raw.setdefault(key, {})
+                for name, value in fields.items():
+                    if value is _MISSING:
+                        section.pop(name, None)
+                    else:
+                        section[name] = value
+
+        changed = set()
+        for key, cls in self._section_classes.items():
+            data = data_raw.get(key, {})
+            if key in self._section_instances and data == (
+                self._section_data_raw.get(key, {})
+            ):
+                continue
+            self._section_data[key] = data
+            try:
+                if key not in self._section_instances:
+                    # has not yet been initialised - new plugin?
+                    cls()
+                else:
+                    # needs reinitialising
+                    self._section_instances[key].__init__()
+            except ValueError as e:
+                self.logger.error(
+                    "Invalid config for section '%s', keeping the previous "
+                    "values",
+                    key,
+                    exc_info=e,
+                )
+                # so that the invalid values aren't written back either
+                if key in self._section_data_raw:
+                    data_raw[key] = self._section_data_raw[key]
+                else:
+                    data_raw.pop(key, None)
+                continue
+            changed.add(key)
+
+        self._section_data_raw = data_raw
+        for key in self._section_classes:
+            self._section_data[key] = data_raw.get(key, {})
+
+        for key in changed:
+            self._notify(key)
+        return changed
+
+    def _notify(self, id: str):
+        """
+        calls the subscribers to a section, and those to every section
+        """
+        callbacks = self._subscribers.get(id, []) + self._subscribers.get(
+            None, []
+        )
+        for callback in callbacks:
+            try:
+                callback(self._section_instances[id])
+            except Exception as e:
+                self.logger.error(
+                    "Exception in subscriber to config section '%s'",
+                    id,
+                    exc_info=e,
+                )
+
+    def subscribe(
+        self, id: Optional[str], callback: Callable[[BaseModel], Any]
+    ):
+        """
+        registers a function to be called with a section whenever the section
+        is changed, by reloading the config or by assigning to one of its
+        fields. It should be quick, e.g. to rebuild caches derived from the
+        config, and mustn't change the config itself.
+        :param id: the ID of the section, or None for every section
+        :param callback: the function to call
+        """
+        self._subscribers.setdefault(id, []).append(callback)
+
+    def unsubscribe(
+        self, id: Optional[str], callback: Callable[[BaseModel], Any]
+    ):
+        self._subscribers[id].remove(callback)
+
+    def watch(self, poll_interval: float = 2.0):
+        """
+        starts reloading the config automatically whenever the file changes
+        :param poll_interval: how often to check the file for changes if
+        inotify is not available
+        """
+        self._watcher = FileWatcher(
+            self.path, self._reload_changed, poll_interval
+        )
+        self._watcher.start()
+
+    def unwatch(self):
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _reload_changed(self):
+        if self._written is not None and self._stat() == self._written:
+            # the bot's own write
+            return
+        try:
+            changed = self.reload()
+        except ValueError as e:
+            self.logger.error(
+                "Failed to reload config from '%s'", self.path, exc_info=e
+            )
+        else:
+            if changed:
+                self.logger.info(
+                    "Reloaded config sections: %s", ", ".join(sorted(changed))
+                )
 
     def load(self, path: pathlib.Path):
         self.path = path
         with self.path.open("r") as f:
             self._section_data_raw = json.load(f)
 
-        for key, cls in self._section_classes:
+        for key in self._section_classes:
             self._section_data[key] = self._section_data_raw.get(key, {})
 
     def flush_config(self):
-        with self.path.open("w") as f:
-            json.dump(f, self._section_data_raw)
+        """
+        schedules the config to be written to the file. If the event loop is
+        running, the write happens later in an executor, together with any
+        other changes made in the meantime. Otherwise it happens immediately.
+        """
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._flush_task is None:
+            if self._flush_requested is None:
+                self._flush_requested = asyncio.Event()
+            self._flush_task = loop.create_task(self._write_behind())
+
+    def flush(self):
+        """
+        writes any pending changes to the config file immediately, blocking
+        until done. Coroutines should use `await flushed()` instead.
+        """
+        if self._dirty:
+            self._dirty = False
+            self._writing, self._unflushed = self._unflushed, {}
+            try:
+                self._write(self._dumps())
+            except Exception:
+                self._restore_unflushed()
+                raise
+            finally:
+                self._writing = {}
+
+    async def flushed(self):
+        """
+        writes any pending changes to the config file without waiting for the
+        flush delay, and waits until they have been written
+        """
+        if self._flush_task is not None:
+            self._flush_requested.set()
+            await asyncio.shield(self._flush_task)
+
+    async def _write_behind(self):
+        try:
+            await asyncio.wait_for(
+                self._flush_requested.wait(), self.flush_delay
+            )
+        except asyncio.TimeoutError:
+            pass
+        loop = asyncio.get_running_loop()
+        try:
+            while self._dirty:
+                self._dirty = False
+                self._writing, self._unflushed = self._unflushed, {}
+                await loop.run_in_executor(None, self._write, self._dumps())
+        except Exception as e:
+            # keep the changes so that the next write tries again
+            self._dirty = True
+            self._restore_unflushed()
+            self.logger.error(
+                "Failed to write config to '%s'", self.path, exc_info=e
+            )
+        finally:
+            self._writing = {}
+            self._flush_task = None
+            self._flush_requested.clear()
+
+    def _restore_unflushed(self):
+        # fields changed again since are newer
+        for key, fields in self._writing.items():
+            self._unflushed[key] = {**fields, **self._unflushed.get(key, {})}
+
+    def _dumps(self) -> str:
+        return json.dumps(self._section_data_raw, indent=2)
+
+    def _write(self, data: str):
+        unibot._utils.write_atomic(self.path, data)
+        self._written = self._stat()
 
     def __getitem__(self, item):
         return self._section_instances[item]
@@ -0,0 +1,103 @@
+"""
+rate limits on commands, per user, channel or guild.
+
+Each limit is a token bucket, stored as the single time at which the bucket
+will be full again (the generic cell rate algorithm), in a dictionary keyed
+by ID. A bucket which has refilled is the same as a missing one, so those are
+dropped in sweeps whenever the dictionary has doubled in size, and memory
+only grows with the number of IDs active within each limit's period.
+"""
+
+import time
+from typing import *
+
+SCOPES = ("user", "channel", "guild")
+
+
+class Cooldown:
+    __slots__ = (
+        "rate",
+        "per",
+        "scope",
+        "_interval",
+        "_tolerance",
+        "_buckets",
+        "_sweep_at",
+    )
+
+    # buckets are never swept while there are fewer than this many
+    MIN_SWEEP = 1024
+
+    def __init__(self, rate: int, per: float, scope: str = "user"):
+        """
+        :param rate: the number of calls allowed in each period
+        :param per: the length of the period in seconds
+        :param scope: 'user', 'channel' or 'guild', whose ID the calls are
+        counted by. Guild limits are per channel in DMs.
+        """
+        if scope not in SCOPES:
+            raise ValueError(f"Invalid cooldown scope '{scope}'")
+        if rate < 1 or per <= 0:
+            raise ValueError("Cooldowns need a positive rate and period")
+        self.rate = rate
+        self.per = per
+        self.scope = scope
+        # the time each call takes from the bucket, and how far ahead of now
+        # the bucket may be emptied
+        self._interval = per / rate
+        self._tolerance = per - self._interval
+        # when each bucket will be full again, by time.monotonic
+        self._buckets: Dict[int, float] = {}
+        self._sweep_at = self.MIN_SWEEP
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def key(self, message) -> int:
+        if self.scope == "user":
+            return message.author.id
+        if self.scope == "guild" and message.guild is not None:
+            return message.guild.id
+        return message.channel.id
+
+    def retry_after(self, key: int, now: float) -> float:
+        """
+        :return: 0 if a call may be made now, otherwise the number of seconds
+        until one may
+        """
+        full = self._buckets.get(key, now)
+        return max(0.0, full - now - self._tolerance)
+
+    def consume(self, key: int, now: float):
+        """
+        counts a call, which must be allowed by retry_after
+        """
+        full = self._buckets.get(key, now)
+        self._buckets[key] = max(full, now) + self._interval
+        if len(self._buckets) >= self._sweep_at:
+            self._buckets = {
+                key: full for key, full in self._buckets.items() if full > now
+            }
+            self._sweep_at = max(self.MIN_SWEEP, 2 * len(self._buckets))
+
+    def clear(self):
+        self._buckets.clear()
+        self._sweep_at = self.MIN_SWEEP
+
+
+def hit(cooldowns: Sequence[Cooldown], message) -> float:
+    """
+    counts a call towards every cooldown, unless any of them is exhausted
+    :return: 0 if the call is allowed, otherwise the number of seconds until
+    it would be
+    """
+    now = time.monotonic()
+    keys = [cooldown.key(message) for cooldown in cooldowns]
+    wait = max(
+        cooldown.retry_after(key, now) for cooldown, key in zip(cooldowns, keys)
+    )
+    if wait:
+        return wait
+    for cooldown, key in zip(cooldowns, keys):
+        cooldown.consume(key, now)
+    return 0.0
@@ -0,0 +1,209 @@
+"""
+recording gateway sessions, and replaying them offline.
+
+The recorder listens to the raw frames the bot receives from and sends to the
+gateway, and writes them with their times to a gzip-compressed log from a
+background thread. Received frames are stored as they arrive, still
+compressed by Discord, so recording costs the event loop little more than
+putting them on a queue. The token is removed from the frames sent.
+
+The replayer feeds a log back through the bot as if it were connected:
+every frame is dispatched as socket_raw_receive and socket_response, and
+events are passed to discord.py's parsers, which update the bot's state and
+dispatch the events to plugins. This can be done at the recorded pace or as
+fast as possible, to compare builds against the same traffic.
+
+Frames from different shards can't be told apart, so record a single shard
+per process, e.g. by running the bot under the supervisor.
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import *
+
+MAGIC = b"UNIBOT-GATEWAY-LOG 1\n"
+
+# the kinds of record
+RECEIVE_BYTES = 0
+RECEIVE_TEXT = 1
+SEND = 2
+# the connection closed, so the next frames are compressed afresh
+DISCONNECT = 3
+
+# seconds since the start of the recording, kind and payload length
+_HEADER = struct.Struct("<dBI")
+
+# the end of every complete message in Discord's zlib stream
+ZLIB_SUFFIX = b"\x00\x00\xff\xff"
+
+Record = Tuple[float, int, bytes]
+
+
+def read_log(path: str) -> Iterator[Record]:
+    """
+    :return: the (time, kind, payload) records in a log, in order
+    """
+    with gzip.open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a gateway log")
+        while True:
+            header = f.read(_HEADER.size)
+            if not header:
+                return
+            if len(header) < _HEADER.size:
+                raise ValueError(f"{path} is truncated")
+            offset, kind, length = _HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                raise ValueError(f"{path} is truncated")
+            yield offset, kind, payload
+
+
+class GatewayRecorder:
+    def __init__(self, path: str, token: Optional[str] = None):
+        """
+        :param path: the file to write the log to, which is overwritten
+        :param token: removed from the frames sent
+        """
+        self.path = path
+        self.token = token
+        self.logger = logging.getLogger("unibot.gateway_log")
+        self.records = 0
+        self._start = time.perf_counter()
+        self._queue: Optional[queue.SimpleQueue] = None
+        self._writer: Optional[threading.Thread] = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._queue = queue.SimpleQueue()
+        # opened here so that a bad path fails straight away
+        f = gzip.open(self.path, "wb", compresslevel=6)
+        f.write(MAGIC)
+        self._writer = threading.Thread(
+            target=self._write,
+            args=(f, self._queue),
+            name="unibot-gateway-recorder",
+            daemon=True,
+        )
+        self._writer.start()
+        self.logger.info("Recording the gateway to %s", self.path)
+
+    def stop(self):
+        """
+        writes out the remaining records and closes the log
+        """
+        if self._queue is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._queue = self._writer = None
+        self.logger.info("Recorded %s gateway frames", self.records)
+
+    def _record(self, kind: int, payload: bytes):
+        if self._queue is not None:
+            self.records += 1
+            self._queue.put((time.perf_counter() - self._start, kind, payload))
+
+    def on_socket_raw_receive(self, message: Union[bytes, str]):
+        if isinstance(message, str):
+            self._record(RECEIVE_TEXT, message.encode())
+        else:
+            self._record(RECEIVE_BYTES, bytes(message))
+
+    def on_socket_raw_send(self, data: Union[bytes, str]):
+        if isinstance(data, bytes):
+            data = data.decode(errors="replace")
+        if self.token:
+            data = data.replace(self.token, "<token>")
+        self._record(SEND, data.encode())
+
+    def on_disconnect(self):
+        self._record(DISCONNECT, b"")
+
+    def _write(self, f: gzip.GzipFile, records: queue.SimpleQueue):
+        try:
+            while True:
+                record = records.get()
+                if record is None:
+                    return
+                offset, kind, payload = record
+                f.write(_HEADER.pack(offset, kind, len(payload)))
+                f.write(payload)
+        except Exception as e:
+            self.logger.error("Failed to write the gateway log", exc_info=e)
+        finally:
+            f.close()
+
+
+class GatewayReplayer:
+    def __init__(self, bot, path: str):
+        """
+        :param bot: a bot which has been set up but not connected, which the
+        frames are dispatched to
+        :param path: the log to replay
+        """
+        self.bot = bot
+        self.path = path
+        self.logger = logging.getLogger("unibot.gateway_log")
+        self.frames = 0
+        self.events = 0
+
+    async def replay(self, speed: float = 1.0):
+        """
+        :param speed: a multiple of the recorded pace, or 0 to replay as fast
+        as possible
+        """
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        decompress = zlib.decompressobj()
+        buffer = bytearray()
+        for i, (offset, kind, payload) in enumerate(read_log(self.path)):
+            if speed:
+                delay = start + offset / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif i % 100 == 0:
+                # let the listeners run, rather than queueing every event first
+                await asyncio.sleep(0)
+            if kind == DISCONNECT:
+                decompress = zlib.decompressobj()
+                buffer = bytearray()
+                continue
+            if kind == SEND:
+                # the bot being replayed sends its own frames, if any
+                continue
+            self.frames += 1
+            if kind == RECEIVE_TEXT:
+                text = payload.decode()
+                self.bot.dispatch("socket_raw_receive", text)
+            else:
+                self.bot.dispatch("socket_raw_receive", payload)
+                buffer.extend(payload)
+                if len(payload) < 4 or payload[-4:] != ZLIB_SUFFIX:
+                    continue
+                text = decompress.decompress(buffer).decode()
+                buffer = bytearray()
+            self._receive(json.loads(text))
+
+    def _receive(self, message: dict):
+        self.bot.dispatch("socket_response", message)
+        if message.get("op") != 0:
+            return
+        parser = self.bot._connection.parsers.get(message.get("t"))
+        if parser is None:
+            return
+        self.events += 1
+        try:
+            parser(message["d"])
+        except Exception as e:
+            # so that one bad event doesn't end the replay
+            self.logger.error(
+                "Failed to parse %s event", message.get("t"), exc_info=e
+            )
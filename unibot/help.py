@@ -0,0 +1,143 @@
+"""
+pre-rendered, searchable help for the command tree.
+
+Rendering help with argparse is slow, and the help for the whole tree is too
+long for one message, so the index renders a page for each command once, and
+keeps the pages until commands are added or removed.
+"""
+
+import bisect
+import re
+from typing import *
+
+from unibot.command import BaseCommand, CommandWithSubCommands
+
+# leave room for the code block around each page
+PAGE_LENGTH = 1900
+
+_TOKEN = re.compile(r"\w+")
+
+
+def _tokens(text: Optional[str]) -> Set[str]:
+    return set(_TOKEN.findall(text.lower())) if text else set()
+
+
+def _paginate(lines: Iterable[str]) -> List[str]:
+    pages = []
+    page = []
+    length = 0
+    for line in lines:
+        # lines longer than a page are split too
+        while len(line) > PAGE_LENGTH:
+            head, line = line[:PAGE_LENGTH], line[PAGE_LENGTH:]
+            if page:
+                pages.append("\n".join(page))
+                page, length = [], 0
+            pages.append(head)
+        if length + len(line) + 1 > PAGE_LENGTH and page:
+            pages.append("\n".join(page))
+            page, length = [], 0
+        page.append(line)
+        length += len(line) + 1
+    if page:
+        pages.append("\n".join(page))
+    return pages or [""]
+
+
+def _page(pages: List[str], number: int) -> Tuple[str, int, int]:
+    number = max(1, min(number, len(pages)))
+    return pages[number - 1], number, len(pages)
+
+
+class HelpIndex:
+    def __init__(self, bot):
+        self.bot = bot
+        self._valid = False
+        # the pages of the list of all commands
+        self._overview: List[str] = []
+        # the pages of each command's own help, by its full name
+        self._pages: Dict[str, List[str]] = {}
+        self._summaries: Dict[str, str] = {}
+        self._commands_by_token: Dict[str, Set[str]] = {}
+        self._sorted_tokens: List[str] = []
+
+    def invalidate(self):
+        self._valid = False
+
+    def _build(self):
+        self._pages.clear()
+        self._summaries.clear()
+        self._commands_by_token.clear()
+        self._add(self.bot.subcommands, [])
+        self._sorted_tokens = sorted(self._commands_by_token)
+        self._overview = _paginate(self._summary_lines(sorted(self._summaries)))
+        self._valid = True
+
+    def _add(self, command: BaseCommand, path: List[str]):
+        if path:
+            name = " ".join(path)
+            self._pages[name] = _paginate(
+                command.parser.format_help().splitlines()
+            )
+            self._summaries[name] = command.help or command.description or ""
+            for token in {
+                *_tokens(name),
+                *_tokens(command.help),
+                *_tokens(command.description),
+            }:
+                self._commands_by_token.setdefault(token, set()).add(name)
+        if isinstance(command, CommandWithSubCommands):
+            for name, subcommand in command._commands_callbacks.items():
+                self._add(subcommand, [*path, name])
+
+    def overview(self, page: int) -> Tuple[str, int, int]:
+        """
+        :param page: the page number, from 1
+        :return: the page of the list of all commands, its number (clamped to
+        the valid range), and the number of pages
+        """
+        if not self._valid:
+            self._build()
+        return _page(self._overview, page)
+
+    def command(self, name: str, page: int) -> Optional[Tuple[str, int, int]]:
+        """
+        :param name: the full name of the command, e.g. 'config set'
+        :param page: the page number, from 1
+        :return: the page of the command's help, its number and the number of
+        pages, or None if there is no such command
+        """
+        if not self._valid:
+            self._build()
+        pages = self._pages.get(name)
+        if pages is None:
+            return None
+        return _page(pages, page)
+
+    def search(self, query: str, page: int) -> Optional[Tuple[str, int, int]]:
+        """
+        finds the commands which have a word starting with every word of the
+        query in their name or help
+        :param page: the page number, from 1
+        :return: the page of the list of commands found, its number and the
+        number of pages, or None if no commands were found
+        """
+        if not self._valid:
+            self._build()
+        tokens = self._sorted_tokens
+        found = None
+        for word in _tokens(query):
+            matches = set()
+            i = bisect.bisect_left(tokens, word)
+            while i < len(tokens) and tokens[i].startswith(word):
+                matches |= self._commands_by_token[tokens[i]]
+                i += 1
+            found = matches if found is None else found & matches
+        if not found:
+            return None
+        return _page(_paginate(self._summary_lines(sorted(found))), page)
+
+    def _summary_lines(self, names: Iterable[str]) -> Iterator[str]:
+        for name in names:
+            summary = self._summaries[name]
+            yield f"{name} - {summary}" if summary else name
@@ -0,0 +1,38 @@
+import asyncio
+import contextlib
+from typing import *
+
+
+class KeyedSemaphore:
+    """
+    a separate semaphore for each key (e.g. a guild or user ID), limiting how
+    many holders each key may have at once. Semaphores are discarded when
+    nothing is holding or waiting for them.
+    """
+
+    def __init__(self, value: Optional[int]):
+        """
+        :param value: the maximum number of holders per key, or None for no
+        limit
+        """
+        self.value = value
+        self._semaphores: Dict[Hashable, asyncio.Semaphore] = {}
+        self._users: Dict[Hashable, int] = {}
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, key: Optional[Hashable]):
+        if self.value is None or key is None:
+            yield
+            return
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = self._semaphores[key] = asyncio.Semaphore(self.value)
+        self._users[key] = self._users.get(key, 0) + 1
+        try:
+            async with semaphore:
+                yield
+        finally:
+            self._users[key] -= 1
+            if not self._users[key]:
+                del self._users[key]
+                del self._semaphores[key]
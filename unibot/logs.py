@@ -0,0 +1,105 @@
+"""
+logging which never blocks the event loop.
+
+Log records are put on a queue, and a background thread formats them and
+writes them out, so a slow stderr doesn't stall the bot. Records on hot paths
+can be sampled or rate limited by passing `extra={"sample": n}` to keep one
+in n of them, or `extra={"rate_limit": n}` to keep at most n per second of
+each message.
+"""
+
+import logging
+import logging.handlers
+import queue
+import time
+from typing import *
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only merge the arguments into the message, as they may change
+        # before the listener gets to the record. Everything else, including
+        # any traceback, is formatted by the listener.
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class LogThrottle(logging.Filter):
+    """
+    drops records which are sampled or rate limited
+    """
+
+    def __init__(self):
+        super(LogThrottle, self).__init__()
+        self._samples: Dict[Tuple[str, str], int] = {}
+        # (tokens, last updated, number suppressed) for each message
+        self._buckets: Dict[Tuple[str, str], List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample = getattr(record, "sample", None)
+        if sample is not None:
+            key = (record.name, record.msg)
+            seen = self._samples.get(key, 0)
+            self._samples[key] = seen + 1
+            if seen % sample:
+                return False
+        rate = getattr(record, "rate_limit", None)
+        if rate is not None:
+            key = (record.name, record.msg)
+            now = time.monotonic()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [rate, now, 0]
+            tokens, updated, suppressed = bucket
+            tokens = min(rate, tokens + (now - updated) * rate)
+            if tokens < 1:
+                bucket[:] = tokens, now, suppressed + 1
+                return False
+            bucket[:] = tokens - 1, now, 0
+            if suppressed:
+                record.suppressed = suppressed
+        return True
+
+
+class _Formatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super(_Formatter, self).format(record)
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            text += f" ({suppressed} similar messages suppressed)"
+        return text
+
+
+def setup(
+    logger: logging.Logger, format: str, stream=None
+) -> logging.handlers.QueueListener:
+    """
+    makes a logger write its records, and those of its children, from a
+    background thread
+    :param format: the format of records, in the '{' style
+    :param stream: where to write records, by default stderr
+    :return: the running listener, which must be stopped to write out the
+    remaining records
+    """
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(LogThrottle())
+    logger.addHandler(handler)
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(_Formatter(format, style="{"))
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    return listener
+
+
+def set_level(logger: logging.Logger, level: str):
+    """
+    sets the level of a logger by name, e.g. 'INFO', keeping the current
+    level if the name is invalid
+    """
+    try:
+        logger.setLevel(level.upper())
+    except ValueError:
+        logger.error("Invalid log level '%s'", level)
@@ -2,6 +2,9 @@ import asyncio
 
 THUMBS_EMOJI = ("\N{thumbs up sign}", "\N{thumbs down sign}")
 TICK_CROSS_EMOJI = ("\N{check mark}", "\N{cross mark}")
+LETTER_EMOJI = tuple(
+    chr(ord("\N{regional indicator symbol letter a}") + i) for i in range(20)
+)
 
 
 class _SelfMapper:
@@ -11,7 +14,13 @@ class _SelfMapper:
 
 class Menu:
     def __init__(
-        self, bot, question, options, emoji=TICK_CROSS_EMOJI, mapper=None
+        self,
+        bot,
+        question,
+        options,
+        emoji=TICK_CROSS_EMOJI,
+        mapper=None,
+        timeout=None,
     ):
         if len(options) > len(emoji):
             raise ValueError("too many options")
@@ -20,31 +29,37 @@ class Menu:
         self.emoji = emoji
         self.bot = bot
         self.mapper = mapper or _SelfMapper()
+        self.timeout = timeout
 
     def create_text(self, question, options, emoji):
         return question + "\n" + "\n".join(map(": ".join, zip(emoji, options)))
 
-    def _check(self, target_user, message):
+    def _check(self, target_user):
         return (
-            lambda reaction, user: reaction.message == message
-            and user == target_user
+            lambda reaction, user: user == target_user
             and reaction.emoji in self.emoji
         )
 
     async def _run(self, channel, target_user):
-        message = await channel.send(self.text)
-        await asyncio.gather(
-            (
-                message.add_reaction(emoji)
-                for emoji in self.emoji[: len(self.options) - 1]
+        message = await self.bot.send(channel, self.text, merge=False)
+        # start watching before adding the reactions, so none are missed
+        with self.bot.reactions.watch(
+            message, self._check(target_user), self.timeout
+        ) as route:
+            await asyncio.gather(
+                *(
+                    self.bot.outbound.add_reaction(message, emoji)
+                    for emoji in self.emoji[: len(self.options)]
+                )
             )
-        )
-        reaction = await self.bot.wait_for(
-            "reaction_add", check=self._check(message, target_user)
-        )
+            reaction, _ = await route.get()
         return reaction
 
     async def run(self, channel, target_user):
+        """
+        :raises asyncio.TimeoutError: if the menu has a timeout and no option
+        is chosen in time
+        """
         reaction = await self._run(channel, target_user)
         return self.mapper[self.options[self.emoji.index(reaction.emoji)]]
 
@@ -52,9 +67,11 @@ class Menu:
 class YesNoMenu(Menu):
     _options = ["Yes", "No"]
 
-    def __init__(self, bot, question, emoji=THUMBS_EMOJI):
-        super(YesNoMenu, self).__init__(bot, question, self._options, emoji)
+    def __init__(self, bot, question, emoji=THUMBS_EMOJI, timeout=None):
+        super(YesNoMenu, self).__init__(
+            bot, question, self._options, emoji, timeout=timeout
+        )
 
-    def run(self, channel, target_user):
-        reaction = self._run(channel, target_user)
-        return reaction == self.emoji[0]
+    async def run(self, channel, target_user):
+        reaction = await self._run(channel, target_user)
+        return reaction.emoji == self.emoji[0]
@@ -0,0 +1,317 @@
+"""
+metrics in the Prometheus text format, served over HTTP.
+
+Metrics are only updated from the event loop's thread, so they are plain
+dictionaries of numbers without locks; updating one costs a dictionary
+lookup. Values which are already tracked elsewhere are read through gauges
+when the metrics are scraped.
+"""
+
+import bisect
+import logging
+import math
+from typing import *
+
+from aiohttp import web
+
+_Labels = Tuple[str, ...]
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# in seconds
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    type: str
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._samples()
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super(Counter, self).__init__(name, help, labels)
+        self._values: Dict[_Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        """
+        :param labels: the values of the counter's labels, in order
+        """
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> Iterator[str]:
+        for labels, value in self._values.items():
+            yield (
+                f"{self.name}{_format_labels(self.labels, labels)} "
+                f"{_format_value(value)}"
+            )
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # for each set of labels, the number of observations in each bucket
+        # (not cumulative, with one more for +Inf), and their sum
+        self._counts: Dict[_Labels, List[int]] = {}
+        self._sums: Dict[_Labels, float] = {}
+
+    def observe(self, value: float, *labels: str):
+        counts = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+            self._sums[labels] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[labels] += value
+
+    def _samples(self) -> Iterator[str]:
+        names = (*self.labels, "le")
+        for labels, counts in self._counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                total += count
+                le = _format_value(bound)
+                yield (
+                    f"{self.name}_bucket{_format_labels(names, (*labels, le))}"
+                    f" {total}"
+                )
+            label_text = _format_labels(self.labels, labels)
+            yield (
+                f"{self.name}_sum{label_text} "
+                f"{_format_value(self._sums[labels])}"
+            )
+            yield f"{self.name}_count{label_text} {total}"
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        read: Callable[[], Union[float, Dict[_Labels, float]]],
+        labels: Sequence[str] = (),
+    ):
+        """
+        :param read: called when the metrics are scraped, returning the value,
+        or if the gauge has labels, a dictionary of values by their labels
+        """
+        super(Gauge, self).__init__(name, help, labels)
+        self.read = read
+
+    def _samples(self) -> Iterator[str]:
+        values = self.read()
+        if not self.labels:
+            values = {(): values}
+        for labels, value in values.items():
+            if value is None:
+                continue
+            yield (
+                f"{self.name}{_format_labels(self.labels, labels)} "
+                f"{_format_value(value)}"
+            )
+
+
+class CounterReader(Gauge):
+    """
+    a counter whose value is kept elsewhere, and read when the metrics are
+    scraped
+    """
+
+    type = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels=(), **kwargs) -> Histogram:
+        return self.register(Histogram(name, help, labels, **kwargs))
+
+    def gauge(self, name: str, help: str, read, labels=()) -> Gauge:
+        return self.register(Gauge(name, help, read, labels))
+
+    def counter_reader(self, name: str, help: str, read, labels=()):
+        return self.register(CounterReader(name, help, read, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+
+class BotMetrics(Registry):
+    """
+    the metrics updated by the bot itself
+    """
+
+    def __init__(self, bot):
+        super(BotMetrics, self).__init__()
+        self.messages = self.counter(
+            "unibot_messages_total", "messages received"
+        )
+        self.prefixed_messages = self.counter(
+            "unibot_prefixed_messages_total",
+            "messages received which start with a command prefix",
+        )
+        self.commands = self.counter(
+            "unibot_commands_total", "commands dispatched", ["command"]
+        )
+        self.cooldowns = self.counter(
+            "unibot_command_cooldowns_total",
+            "commands dropped for being over a cooldown",
+            ["command"],
+        )
+        self.parse_failures = self.counter(
+            "unibot_command_parse_failures_total",
+            "commands which couldn't be parsed",
+        )
+        self.command_latency = self.histogram(
+            "unibot_command_duration_seconds",
+            "time taken to execute commands",
+            ["command"],
+        )
+        self.events = self.counter(
+            "unibot_events_total", "events dispatched", ["event"]
+        )
+        self.exceptions = self.counter(
+            "unibot_exceptions_total",
+            "exceptions raised by commands and listeners",
+            ["source"],
+        )
+        self.gauge(
+            "unibot_gateway_latency_seconds",
+            "time between a heartbeat and its acknowledgement, for each shard",
+            lambda: {
+                (str(shard),): latency for shard, latency in bot.latencies
+            },
+            ["shard"],
+        )
+        self.gauge(
+            "unibot_outbound_queue_depth",
+            "messages and reactions waiting to be sent",
+            lambda: bot.outbound.depth,
+        )
+        self.gauge(
+            "unibot_thread_pool_busy_threads",
+            "threads running synchronous callbacks and listeners",
+            lambda: bot.thread_pool.busy,
+        )
+        self.gauge(
+            "unibot_thread_pool_queued_calls",
+            "synchronous callbacks and listeners waiting for a thread",
+            lambda: bot.thread_pool.queued,
+        )
+        self.counter_reader(
+            "unibot_command_cache_lookups_total",
+            "lookups of command results in the cache",
+            lambda: {
+                ("hit",): bot.command_cache.hits,
+                ("miss",): bot.command_cache.misses,
+            },
+            ["result"],
+        )
+        self.gauge(
+            "unibot_command_cache_entries",
+            "command results in the cache",
+            lambda: len(bot.command_cache),
+        )
+        self.gauge(
+            "unibot_event_loop_lag_p99_seconds",
+            "99th percentile of recent event loop lag",
+            lambda: bot.loop_monitor and bot.loop_monitor.lag.percentile(99),
+        )
+
+
+class MetricsServer:
+    def __init__(self, registry: Registry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger("unibot.metrics")
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.render().encode(),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.logger.info(
+            "Serving metrics on http://%s:%s/metrics", self.host, self.port
+        )
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
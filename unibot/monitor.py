@@ -0,0 +1,115 @@
+"""
+monitoring of the event loop's lag.
+
+A task sleeps for a fixed interval and measures how much later than asked it
+was woken, which is how long other callbacks kept the loop busy. A watchdog
+thread notices when the loop stops waking the task, and logs the stack of
+the loop's thread while it is still blocked, to show the code to blame. This
+works with any loop implementation and costs almost nothing when the loop is
+healthy.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import *
+
+from unibot.stats import Timings
+
+
+class LoopMonitor:
+    # seconds between samples
+    INTERVAL = 0.5
+
+    def __init__(
+        self,
+        threshold: float,
+        alert_interval: float,
+        alert: Callable[[str], Any],
+    ):
+        """
+        :param threshold: lag in seconds above which the loop is stalled
+        :param alert_interval: the minimum number of seconds between alerts
+        :param alert: called on the loop with a description of each stall,
+        at most once per alert_interval
+        """
+        self.threshold = threshold
+        self.alert_interval = alert_interval
+        self.alert = alert
+        self.logger = logging.getLogger("unibot.monitor")
+        self.lag = Timings()
+        self.stalls = 0
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._loop_thread: Optional[int] = None
+        # when the sampling task last ran, by time.monotonic
+        self._beat = time.monotonic()
+        # the stack of the loop's thread during the current stall
+        self._stall_stack: Optional[str] = None
+        self._last_alert: Optional[float] = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        """
+        starts monitoring a loop. Call this from the loop's thread.
+        """
+        self._loop_thread = threading.get_ident()
+        self._stopped.clear()
+        self._beat = time.monotonic()
+        self._task = loop.create_task(self._sample(loop))
+        self._watchdog = threading.Thread(
+            target=self._watch, name="unibot-loop-monitor", daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self, loop: asyncio.AbstractEventLoop):
+        while True:
+            before = loop.time()
+            await asyncio.sleep(self.INTERVAL)
+            lag = max(0.0, loop.time() - before - self.INTERVAL)
+            self._beat = time.monotonic()
+            self.lag.record(lag)
+            if lag > self.threshold:
+                self._stalled(lag, loop.time())
+
+    def _stalled(self, lag: float, now: float):
+        self.stalls += 1
+        stack, self._stall_stack = self._stall_stack, None
+        self.logger.warning("Event loop stalled for %.0f ms", lag * 1000)
+        if self._last_alert is None or (
+            now - self._last_alert >= self.alert_interval
+        ):
+            self._last_alert = now
+            text = f"Event loop stalled for {lag * 1000:.0f} ms"
+            if stack is not None:
+                text += f" in:\n{stack}"
+            try:
+                self.alert(text)
+            except Exception as e:
+                self.logger.error("Failed to send loop lag alert", exc_info=e)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            blocked = time.monotonic() - self._beat - self.INTERVAL
+            if blocked <= self.threshold or self._stall_stack is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            # the innermost frames, where the loop is stuck
+            stack = "".join(traceback.format_stack(frame, limit=8))
+            self._stall_stack = stack
+            self.logger.warning(
+                "Event loop blocked for over %.0f ms in:\n%s",
+                blocked * 1000,
+                stack,
+            )
@@ -0,0 +1,254 @@
+"""
+scheduling of outgoing messages and reactions.
+
+Everything the bot sends goes through one queue per channel, which is
+drained at the rate Discord allows for that channel's routes, with command
+replies ahead of diagnostics. Consecutive short messages to the same channel
+are merged into one.
+"""
+import asyncio
+import enum
+import heapq
+import itertools
+import logging
+import time
+from typing import *
+
+import discord
+
+from unibot.stats import Timings
+
+MAX_MESSAGE_LENGTH = 2000
+
+
+class Priority(enum.IntEnum):
+    REPLY = 0
+    DIAGNOSTIC = 1
+
+
+class _Bucket:
+    """
+    a token bucket for one rate-limited route
+    """
+
+    __slots__ = ("rate", "per", "tokens", "updated")
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.rate,
+                self.tokens + (now - self.updated) * self.rate / self.per,
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+    def full(self, now: float) -> bool:
+        """
+        :return: whether the bucket has refilled, so that it is the same as a
+        new one
+        """
+        refilled = self.tokens + (now - self.updated) * self.rate / self.per
+        return refilled >= self.rate
+
+
+class _Item:
+    __slots__ = ("route", "call", "content", "priority", "futures", "starts")
+
+    def __init__(self, route, call, content, priority):
+        self.route: str = route
+        self.call: Callable[[Optional[str]], Awaitable[Any]] = call
+        # the text of a message which can be merged with others, or None
+        self.content: Optional[str] = content
+        self.priority: Priority = priority
+        self.futures: List[asyncio.Future] = []
+        self.starts: List[float] = []
+
+
+def _retrieve(future: asyncio.Future):
+    # exceptions are logged by the scheduler, so don't warn about ones which
+    # the sender never looked at
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundScheduler:
+    # (number of requests, per seconds) allowed for each route, per channel
+    ROUTE_LIMITS = {"messages": (5, 5.0), "reactions": (1, 0.25)}
+    # buckets are never swept while there are fewer than this many
+    MIN_SWEEP = 1024
+
+    def __init__(self):
+        self.logger = logging.getLogger("unibot.outbound")
+        # counts sends and how long they were queued; in_flight is the
+        # current queue depth
+        self.latency = Timings()
+        self._queues: Dict[int, List[Tuple[int, int, _Item]]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._buckets: Dict[Tuple[str, int], _Bucket] = {}
+        self._sweep_at = self.MIN_SWEEP
+        # the last message queued for each channel, while it can be merged
+        self._mergeable: Dict[int, _Item] = {}
+        self._counter = itertools.count()
+
+    @property
+    def depth(self) -> int:
+        return self.latency.in_flight
+
+    def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: Optional[str] = None,
+        *,
+        priority: Priority = Priority.REPLY,
+        merge: bool = True,
+        **kwargs,
+    ) -> "asyncio.Future[discord.Message]":
+        """
+        queues a message to be sent
+        :param merge: if True, and the message is only text, it may be sent
+        as part of one message with other text queued for the channel
+        :param kwargs: passed on to channel.send
+        :return: a future for the message that was sent
+        """
+        channel_id = channel.id
+        mergeable = merge and not kwargs and content is not None
+        if mergeable:
+            item = self._mergeable.get(channel_id)
+            if (
+                item is not None
+                and item.priority == priority
+                and len(item.content) + len(content) < MAX_MESSAGE_LENGTH
+            ):
+                item.content += "\n" + content
+                return self._add_future(item)
+
+        def call(merged_content):
+            if merged_content is not None:
+                return channel.send(merged_content)
+            return channel.send(content, **kwargs)
+
+        item = _Item("messages", call, content if mergeable else None, priority)
+        if mergeable:
+            self._mergeable[channel_id] = item
+        else:
+            self._mergeable.pop(channel_id, None)
+        return self._enqueue(channel_id, item)
+
+    def add_reaction(
+        self,
+        message: discord.Message,
+        emoji,
+        *,
+        priority: Priority = Priority.REPLY,
+    ) -> asyncio.Future:
+        """
+        queues a reaction to be added to a message
+        """
+        channel_id = message.channel.id
+        item = _Item(
+            "reactions", lambda _: message.add_reaction(emoji), None, priority
+        )
+        self._mergeable.pop(channel_id, None)
+        return self._enqueue(channel_id, item)
+
+    def close(self):
+        """
+        stops sending, cancelling the futures of everything still queued
+        """
+        for queue in self._queues.values():
+            for _, _, item in queue:
+                for future in item.futures:
+                    future.cancel()
+                for start in item.starts:
+                    self.latency.finish(start, True)
+            queue.clear()
+        for worker in self._workers.values():
+            worker.cancel()
+
+    def _add_future(self, item: _Item) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(_retrieve)
+        item.futures.append(future)
+        item.starts.append(self.latency.start())
+        return future
+
+    def _enqueue(self, channel_id: int, item: _Item) -> asyncio.Future:
+        future = self._add_future(item)
+        heapq.heappush(
+            self._queues.setdefault(channel_id, []),
+            (item.priority, next(self._counter), item),
+        )
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.create_task(
+                self._drain(channel_id)
+            )
+        return future
+
+    def _bucket(self, route: str, channel_id: int) -> _Bucket:
+        bucket = self._buckets.get((route, channel_id))
+        if bucket is None:
+            bucket = self._buckets[(route, channel_id)] = _Bucket(
+                *self.ROUTE_LIMITS[route]
+            )
+            if len(self._buckets) >= self._sweep_at:
+                self._sweep()
+        return bucket
+
+    def _sweep(self):
+        # drops the buckets of idle channels which have refilled
+        now = time.monotonic()
+        self._buckets = {
+            key: bucket
+            for key, bucket in self._buckets.items()
+            if key[1] in self._workers or not bucket.full(now)
+        }
+        self._sweep_at = max(self.MIN_SWEEP, 2 * len(self._buckets))
+
+    async def _drain(self, channel_id: int):
+        queue = self._queues[channel_id]
+        try:
+            while queue:
+                _, _, item = heapq.heappop(queue)
+                if self._mergeable.get(channel_id) is item:
+                    del self._mergeable[channel_id]
+                try:
+                    await self._bucket(item.route, channel_id).acquire()
+                    result = await item.call(item.content)
+                except asyncio.CancelledError:
+                    for future in item.futures:
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    self.logger.error(
+                        "Failed to send to channel %s", channel_id, exc_info=e
+                    )
+                    for future in item.futures:
+                        future.set_exception(e)
+                else:
+                    for future in item.futures:
+                        future.set_result(result)
+                finally:
+                    for start in item.starts:
+                        self.latency.finish(start)
+        finally:
+            del self._queues[channel_id]
+            del self._workers[channel_id]
+            self._mergeable.pop(channel_id, None)
+            # the channel's buckets can only be dropped once they have
+            # refilled, or its next messages could exceed the rate limit.
+            # Those which haven't yet are dropped by a later sweep.
+            now = time.monotonic()
+            for route in self.ROUTE_LIMITS:
+                bucket = self._buckets.get((route, channel_id))
+                if bucket is not None and bucket.full(now):
+                    del self._buckets[(route, channel_id)]
@@ -1,9 +1,17 @@
 import argparse
-import asyncio
+import contextvars
 from typing import *
 
 import discord
 
+import unibot._globals
+
+# the message which triggered the command currently being executed, set
+# separately for each invocation so that commands can run concurrently
+context_message: "contextvars.ContextVar[Optional[discord.Message]]" = (
+    contextvars.ContextVar("context_message", default=None)
+)
+
 
 class CommandError(Exception):
     pass
@@ -11,8 +19,7 @@ class CommandError(Exception):
 
 class UnibotParser(argparse.ArgumentParser):
     def __init__(self, *args, **kwargs):
-        self.context_message: Optional[discord.Message] = None
-        kwargs["prog"] = "unibot"
+        kwargs.setdefault("prog", "unibot")
         kwargs["add_help"] = False
         super(UnibotParser, self).__init__(*args, **kwargs)
 
@@ -21,7 +28,7 @@ class UnibotParser(argparse.ArgumentParser):
         raise CommandError(message)
 
     def _print_message(self, message, file=None):
-        asyncio.create_task(self.context_message.channel.send(message))
+        unibot._globals.bot.send(context_message.get().channel, message)
 
     def add_subparsers(self, *args, **kwargs):
         return super(UnibotParser, self).add_subparsers(*args, **kwargs)
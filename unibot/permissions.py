@@ -0,0 +1,128 @@
+"""
+resolution of the bot's own permissions (not Discord's) for users.
+
+Permissions are granted to roles and users in the config. The permissions
+of each member are resolved into a frozen set, which is cached until the
+member's roles change or one of the roles is updated or deleted.
+"""
+
+import collections
+from typing import *
+
+import discord
+
+import unibot._globals
+
+# grants every permission
+WILDCARD = "*"
+
+
+class PermissionsConfig(unibot._globals.config.section, id="permissions"):
+    # permissions granted to roles and users, by their ID. Granting to the
+    # ID of a guild grants to its @everyone role.
+    roles: Dict[str, List[str]] = {}
+    users: Dict[str, List[str]] = {}
+    # members with Discord's administrator permission have every permission
+    administrators: bool = True
+    cache_size: int = 4096
+
+
+class _AllPermissions(frozenset):
+    def __contains__(self, item):
+        return True
+
+    def __repr__(self):
+        return "ALL_PERMISSIONS"
+
+
+ALL_PERMISSIONS = _AllPermissions()
+
+_Key = Tuple[Optional[int], int]
+
+
+class PermissionEngine:
+    def __init__(self):
+        self.config: Optional[PermissionsConfig] = None
+        self._cache: "collections.OrderedDict[_Key, FrozenSet[str]]" = (
+            collections.OrderedDict()
+        )
+        # the cache keys which depend on each role, and the other way round
+        self._keys_by_role: Dict[int, Set[_Key]] = {}
+        self._roles_by_key: Dict[_Key, Tuple[int, ...]] = {}
+
+    def load(self):
+        self.config = PermissionsConfig()
+        unibot._globals.config.subscribe("permissions", self._config_changed)
+
+    def _config_changed(self, config: PermissionsConfig):
+        self.config = config
+        self.clear()
+
+    def get(self, user: Union[discord.User, discord.Member]) -> FrozenSet[str]:
+        """
+        :return: the permissions of a user, in the guild they are a member of
+        if they are a member
+        """
+        guild = getattr(user, "guild", None)
+        key = (guild and guild.id, user.id)
+        permissions = self._cache.get(key)
+        if permissions is not None:
+            self._cache.move_to_end(key)
+            return permissions
+
+        permissions = self._resolve(user, guild)
+        self._cache[key] = permissions
+        if guild is not None:
+            roles = self._roles_by_key[key] = tuple(
+                role.id for role in user.roles
+            )
+            for role_id in roles:
+                self._keys_by_role.setdefault(role_id, set()).add(key)
+        if len(self._cache) > self.config.cache_size:
+            self._evict(next(iter(self._cache)))
+        return permissions
+
+    def _resolve(self, user, guild) -> FrozenSet[str]:
+        if (
+            guild is not None
+            and self.config.administrators
+            and user.guild_permissions.administrator
+        ):
+            return ALL_PERMISSIONS
+        granted = set(self.config.users.get(str(user.id), ()))
+        if guild is not None:
+            for role in user.roles:
+                granted.update(self.config.roles.get(str(role.id), ()))
+        if WILDCARD in granted:
+            return ALL_PERMISSIONS
+        return frozenset(granted)
+
+    def clear(self):
+        self._cache.clear()
+        self._keys_by_role.clear()
+        self._roles_by_key.clear()
+
+    def _evict(self, key: _Key):
+        self._cache.pop(key, None)
+        for role_id in self._roles_by_key.pop(key, ()):
+            keys = self._keys_by_role.get(role_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_role[role_id]
+
+    def _evict_role(self, role: discord.Role):
+        for key in list(self._keys_by_role.get(role.id, ())):
+            self._evict(key)
+
+    # inline event listeners
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.roles != after.roles:
+            self._evict((after.guild.id, after.id))
+
+    def on_guild_role_update(self, before: discord.Role, after: discord.Role):
+        if before.permissions.administrator != after.permissions.administrator:
+            self._evict_role(after)
+
+    def on_guild_role_delete(self, role: discord.Role):
+        self._evict_role(role)
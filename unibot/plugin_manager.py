@@ -1,13 +1,22 @@
+import argparse
+import ast
 import asyncio
 import importlib.machinery
 import importlib.util
+import json
 import logging
+import os
 import pathlib
 import pkgutil
 import types
-from typing import Optional, Sequence, Mapping, Union
+from typing import Optional, Sequence, Mapping, Union, List, Tuple, Callable
+from typing import Dict, Iterator
 
+import unibot._utils
 import unibot.config
+from unibot.command import BaseCommand
+from unibot.parser import CommandError
+from unibot.stats import PluginStats
 
 
 class PluginManifest:
@@ -20,44 +29,470 @@ class PluginManifest:
     source: Optional[str] = None
     issues: Optional[str] = None
     requirements: Sequence[Mapping[str, str]] = ()
+    # top-level commands and events the plugin provides, used to load it
+    # lazily. If not given, they are found from the plugin's source.
+    commands: Sequence[str] = ()
+    events: Sequence[str] = ()
 
 
 class PluginsConfig(unibot._globals.config.section, id="plugins"):
     plugin_search_directories: Sequence[str] = ("plugins",)
     plugins_enabled: Sequence[str] = ()
     plugin_unload_timeout: Union[float, int] = 5
+    # only import plugins when one of their commands or listeners is first
+    # used, for plugins whose manifest can be read without importing them
+    lazy_plugins: bool = False
+    # where to cache the results of searching for plugins between restarts,
+    # relative to the config file, or None to search every time
+    plugin_index_path: Optional[str] = ".plugin_index.json"
 
 
 class _PluginModule(types.ModuleType):
     __manifest__: PluginManifest
 
 
+def _literal_attributes(node: ast.ClassDef):
+    """
+    :return: the class attributes of a class definition which are assigned
+    literal values
+    """
+    attributes = {}
+    for statement in node.body:
+        if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+            target = statement.targets[0]
+        elif isinstance(statement, ast.AnnAssign) and statement.value:
+            target = statement.target
+        else:
+            continue
+        if isinstance(target, ast.Name):
+            try:
+                attributes[target.id] = ast.literal_eval(statement.value)
+            except ValueError:
+                pass
+    return attributes
+
+
+def _is_bot_attribute(node: ast.expr, name: str) -> bool:
+    return (
+        isinstance(node, ast.Attribute)
+        and node.attr == name
+        and isinstance(node.value, ast.Name)
+        and node.value.id == "bot"
+    )
+
+
+def read_static_manifest(
+    spec: importlib.machinery.ModuleSpec,
+) -> Optional[PluginManifest]:
+    """
+    reads a plugin's manifest, and the commands and events it provides,
+    without importing it. The manifest must be a class named `__manifest__`
+    with literal attributes, e.g.
+    ```
+    class __manifest__(PluginManifest):
+        name = "example"
+        version = "1.0"
+    ```
+    If the manifest does not declare the commands and events, they are
+    found from classes decorated with `@bot.command` and functions decorated
+    with `@bot.event_listener(...)` at the top level of the module.
+    :return: the manifest, or None if it can't be read statically
+    """
+    try:
+        with open(spec.origin, "rb") as f:
+            tree = ast.parse(f.read(), spec.origin)
+    except (OSError, TypeError, SyntaxError, ValueError):
+        return None
+
+    manifest = None
+    commands = []
+    events = []
+    for statement in tree.body:
+        if isinstance(statement, ast.ClassDef):
+            if statement.name == "__manifest__":
+                manifest = PluginManifest()
+                for key, value in _literal_attributes(statement).items():
+                    setattr(manifest, key, value)
+            elif any(
+                _is_bot_attribute(decorator, "command")
+                for decorator in statement.decorator_list
+            ):
+                name = _literal_attributes(statement).get("name")
+                if not isinstance(name, str):
+                    return None
+                commands.append(name)
+        elif isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for decorator in statement.decorator_list:
+                if isinstance(decorator, ast.Call) and _is_bot_attribute(
+                    decorator.func, "event_listener"
+                ):
+                    try:
+                        events.append(ast.literal_eval(decorator.args[0]))
+                    except (IndexError, ValueError):
+                        return None
+
+    if manifest is None or not isinstance(getattr(manifest, "name", None), str):
+        return None
+    if not manifest.commands and not manifest.events:
+        manifest.commands = tuple(commands)
+        manifest.events = tuple(events)
+    return manifest
+
+
+class _LazyPlugin:
+    def __init__(self, spec, manifest):
+        self.spec: importlib.machinery.ModuleSpec = spec
+        self.manifest: PluginManifest = manifest
+        self.commands: List[type] = []
+        self.listeners: List[Tuple[str, Callable]] = []
+
+
+class _LazyCommand(BaseCommand):
+    """
+    stands in for a command of a plugin which has not been imported yet
+    """
+
+    plugin_manager: "PluginManager"
+    plugin: str
+
+    def parse_args(self, args):
+        # the real command parses the arguments once it has been imported
+        return argparse.Namespace(args=list(args))
+
+    async def callback(self, message, args):
+        bot = self.plugin_manager.bot
+        self.plugin_manager.import_lazy_plugin(self.plugin)
+        try:
+            command, namespace = bot.router.resolve([self.name, *args])
+        except CommandError:
+            # the parser has already replied with the usage error
+            bot.metrics.parse_failures.inc()
+            return
+        return await command(message, namespace)
+
+
+class PluginIndex:
+    """
+    an on-disk cache of the plugins found in the plugin search directories,
+    and their static manifests. Directories are only listed again if their
+    modification time has changed, and manifests are only read again if
+    their file's modification time or size has changed.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Optional[pathlib.Path]):
+        self.path = path
+        self.logger = logging.getLogger("unibot.plugins")
+        self.reused = 0
+        self.scanned = 0
+        self._directories: Dict[str, dict] = {}
+        self._entries: Dict[str, dict] = {}
+        self._new_directories: Dict[str, dict] = {}
+        self._new_entries: Dict[str, dict] = {}
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with self.path.open("r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            self.logger.warning(
+                "Ignoring invalid plugin index '%s'", self.path, exc_info=e
+            )
+            return
+        if data.get("version") == self.VERSION:
+            self._directories = data["directories"]
+            self._entries = data["plugins"]
+
+    def save(self):
+        """
+        writes the index, if anything found since it was loaded has changed
+        """
+        if self.path is None:
+            return
+        if (
+            self._new_directories == self._directories
+            and self._new_entries == self._entries
+        ):
+            return
+        data = {
+            "version": self.VERSION,
+            "directories": self._new_directories,
+            "plugins": self._new_entries,
+        }
+        try:
+            unibot._utils.write_atomic(self.path, json.dumps(data))
+        except OSError as e:
+            self.logger.warning(
+                "Failed to save plugin index '%s'", self.path, exc_info=e
+            )
+
+    def find_plugins(
+        self, directories: Sequence[str]
+    ) -> Iterator[Tuple[str, importlib.machinery.ModuleSpec]]:
+        """
+        finds the plugins in some directories
+        :return: the name and module spec of each plugin
+        """
+        for directory in directories:
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            cached = self._directories.get(directory)
+            if cached is not None and cached["mtime_ns"] == mtime:
+                origins = cached["origins"]
+            else:
+                origins = list(self._scan_directory(directory))
+            self._new_directories[directory] = {
+                "mtime_ns": mtime,
+                "origins": origins,
+            }
+            for origin in origins:
+                entry = self._entry(origin)
+                if entry is None:
+                    continue
+                yield entry["name"], importlib.util.spec_from_file_location(
+                    entry["name"],
+                    origin,
+                    submodule_search_locations=(
+                        [os.path.dirname(origin)] if entry["package"] else None
+                    ),
+                )
+
+    def manifest(
+        self, spec: importlib.machinery.ModuleSpec
+    ) -> Optional[PluginManifest]:
+        """
+        reads a plugin's static manifest, using the cached one if the file
+        hasn't changed
+        """
+        entry = self._new_entries.get(spec.origin)
+        if entry is not None and "manifest" in entry:
+            if entry["manifest"] is None:
+                return None
+            manifest = PluginManifest()
+            for key, value in entry["manifest"].items():
+                setattr(manifest, key, value)
+            return manifest
+        manifest = read_static_manifest(spec)
+        if entry is not None:
+            data = None if manifest is None else vars(manifest)
+            try:
+                json.dumps(data)
+            except (TypeError, ValueError):
+                # read it again next time
+                pass
+            else:
+                entry["manifest"] = data
+        return manifest
+
+    def _scan_directory(self, directory):
+        for finder, name, _ in pkgutil.iter_modules([directory]):
+            spec = finder.find_spec(name)
+            if spec is None or spec.origin is None:
+                self.logger.debug(
+                    "Ignoring plugin %s with no module spec available", name
+                )
+                continue
+            self._new_entries[spec.origin] = {
+                "name": name,
+                "package": spec.submodule_search_locations is not None,
+            }
+            yield spec.origin
+
+    def _entry(self, origin) -> Optional[dict]:
+        try:
+            stat = os.stat(origin)
+        except FileNotFoundError:
+            return None
+        entry = self._entries.get(origin)
+        if (
+            entry is not None
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and entry["size"] == stat.st_size
+        ):
+            self.reused += 1
+        else:
+            # found by _scan_directory(), or cached but changed since
+            found = self._new_entries.get(origin) or entry
+            if found is None:
+                return None
+            self.scanned += 1
+            entry = {
+                "name": found["name"],
+                "package": found["package"],
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+            }
+        self._new_entries[origin] = entry
+        return entry
+
+
 class PluginManager:
     PLUGIN_NAME = "unibot._loaded_plugin_{name}"
+    # the name stats are recorded under for code not belonging to a plugin
+    CORE_STATS = "core"
 
     def __init__(self, bot):
         self.bot = bot
         self.plugins = {}
+        self.lazy_plugins = {}
+        self.stats: Dict[str, PluginStats] = {}
+        # cache of the stats for each module which has run something
+        self._module_stats: Dict[str, PluginStats] = {}
         self.logger = logging.getLogger("unibot.plugins")
-        self.config = PluginsConfig(self.bot.config_config)
+        # loaded with the rest of the config
+        self.config: Optional[PluginsConfig] = None
+
+    def load_config(self):
+        self.config = PluginsConfig()
+
+    def stats_for(self, module: str) -> PluginStats:
+        """
+        :param module: the name of the module that defined a command or
+        listener
+        :return: the stats of the plugin the module belongs to
+        """
+        stats = self._module_stats.get(module)
+        if stats is None:
+            name = self._find_plugin(module)
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = PluginStats()
+            self._module_stats[module] = stats
+        return stats
+
+    def _find_plugin(self, module: str) -> str:
+        plugins = {
+            plugin.__name__: name for name, plugin in self.plugins.items()
+        }
+        while module:
+            if module in plugins:
+                return plugins[module]
+            module = module.rpartition(".")[0]
+        return self.CORE_STATS
 
     def load_plugins(self):
-        for finder, name, _ in pkgutil.iter_modules(
+        index_path = self.config.plugin_index_path
+        if index_path is not None:
+            # next to the config, rather than in whatever the current
+            # directory is
+            index_path = unibot._globals.config.path.parent / index_path
+        index = PluginIndex(index_path)
+        index.load()
+        for name, spec in index.find_plugins(
                 self.config.plugin_search_directories
         ):
-            spec = finder.find_spec(name)
-            if spec is None:
+            if name in self.plugins:
+                self.logger.warning(
+                    "Skipping plugin with duplicate name '%s' from '%s'.",
+                    name,
+                    spec.origin,
+                )
+            if self.config.lazy_plugins:
+                manifest = index.manifest(spec)
+                if manifest is not None and (
+                    manifest.commands or manifest.events
+                ):
+                    self.add_lazy_plugin(spec, manifest)
+                    continue
                 self.logger.debug(
-                    f"Ignoring plugin {name}" f"with no module spec available"
+                    "Loading plugin '%s' eagerly: its manifest can't be read "
+                    "without importing it",
+                    name,
                 )
-                continue
-            else:
-                if name in self.plugins:
-                    self.logger.warning(
-                        f"Skipping plugin with duplicate name"
-                        f"'{name}' from '{spec.origin}'."
+            self.load_plugin_from_spec(spec)
+        index.save()
+        self.logger.info(
+            "Plugin index: %s entries reused, %s re-scanned",
+            index.reused,
+            index.scanned,
+        )
+
+    def add_lazy_plugin(
+        self,
+        spec: importlib.machinery.ModuleSpec,
+        manifest: PluginManifest,
+    ):
+        """
+        registers stand-ins for a plugin's commands and listeners, which
+        import the plugin the first time they are used
+        """
+        lazy = _LazyPlugin(spec, manifest)
+        for command_name in manifest.commands:
+            lazy.commands.append(
+                self.bot.command(
+                    _LazyCommand.new(
+                        command_name,
+                        plugin_manager=self,
+                        plugin=manifest.name,
                     )
-                self.load_plugin_from_spec(spec)
+                )
+            )
+        # one stand-in for each event, however many listeners it has
+        for event in dict.fromkeys(manifest.events):
+            listener = self._lazy_listener(manifest.name, event)
+            self.bot.event_listener(event, inline=True)(listener)
+            lazy.listeners.append((event, listener))
+        self.lazy_plugins[manifest.name] = lazy
+
+    def _lazy_listener(self, name, event):
+        async def deliver(*args, **kwargs):
+            bot = self.bot
+            plugin = self.import_lazy_plugin(name)
+            # the plugin's own listeners missed this event, as the stand-in
+            # was registered instead when it was dispatched. Events which
+            # reach the stand-in before it is replaced are all delivered.
+            own = {
+                fn
+                for module in bot._plugin_modules(
+                    plugin, bot._listeners_by_module
+                )
+                for listened, fn in bot._listeners_by_module[module]
+                if listened == event
+            }
+            bot._dispatch_listeners(event, args, kwargs, only=own)
+
+        def listener(*args, **kwargs):
+            # inline, so that it runs even if the plugin is imported by
+            # another event before this one's task does
+            asyncio.create_task(
+                self.bot._run_listener(event, deliver, args, kwargs)
+            )
+
+        return listener
+
+    def import_lazy_plugin(self, name: str) -> _PluginModule:
+        """
+        imports a lazily loaded plugin, replacing its stand-in commands and
+        listeners with the real ones
+        """
+        lazy = self.lazy_plugins.get(name)
+        if lazy is None:
+            # already imported
+            return self.plugins[name]
+        self.logger.debug("Importing lazily loaded plugin '%s'", name)
+        try:
+            module = self.load_plugin_from_spec(lazy.spec)
+            if module is None:
+                raise ImportError(f"Plugin '{name}' has no manifest")
+        except Exception:
+            # keep the stand-ins, so that the import is tried again next time,
+            # and drop whatever the plugin registered before it failed
+            self.bot.detach_plugin(types.ModuleType(lazy.spec.name))
+            raise
+        del self.lazy_plugins[name]
+        for command in lazy.commands:
+            self.bot.remove_command(self.bot.subcommands_class, command)
+        for event, listener in lazy.listeners:
+            self.bot.remove_event_listener(event, listener)
+        self.bot.attach_plugin(module)
+        return module
 
     async def unload_plugin(self, name, force: bool = False) -> bool:
         """
@@ -82,11 +517,12 @@ class PluginManager:
                     plugin.unload_hook(plugin)
             except Exception as e:
                 self.logger.error(
-                    f"Exception in plugin unload hook for plugin '{name}':",
-                    exc_info=e
+                    "Exception in plugin unload hook for plugin '%s':",
+                    name,
+                    exc_info=e,
                 )
-            if not force:
-                return False
+                if not force:
+                    return False
 
         for hook in self.bot.plugin_unload_hooks:
             try:
@@ -96,20 +532,31 @@ class PluginManager:
                     hook(plugin)
             except Exception as e:
                 self.logger.error(
-                    f"Exception in plugin unload hook '{hook.__name__}'"
-                    f"for plugin {name}:",
+                    "Exception in plugin unload hook '%s' for plugin %s:",
+                    hook.__name__,
+                    name,
                     exc_info=e,
                 )
                 if not force:
                     return False
 
+        del self.plugins[name]
+        self._module_stats.clear()
         return True
 
-    async def reload_plugin(self, name):
-        await self.unload_plugin(name)
-        path = pathlib.Path(self.plugins[name].__file__)
-        importlib.reload(self.plugins[name])
-        self.load_plugin_from_path(path.parent)
+    async def reload_plugin(self, name) -> bool:
+        """
+        unloads a plugin, then runs its module again, replacing only its own
+        commands and listeners
+        :return: True if the reload was successful, False otherwise.
+        """
+        plugin = self.plugins.get(name)
+        if not await self.unload_plugin(name):
+            return False
+        plugin.__spec__.loader.exec_module(plugin)
+        self._add_plugin(plugin)
+        self.bot.attach_plugin(plugin)
+        return True
 
     def load_plugin_from_path(self, path: Union[str, pathlib.Path]):
         spec = importlib.util.spec_from_file_location(str(path))
@@ -125,7 +572,8 @@ class PluginManager:
 
     def _add_plugin(self, module: _PluginModule):
         if not hasattr(module, "__manifest__"):
-            self.logger.error(f"Plugin '{module.__name__}' has no manifest")
+            self.logger.error("Plugin '%s' has no manifest", module.__name__)
         else:
             self.plugins[module.__manifest__.name] = module
+            self._module_stats.clear()
             return module
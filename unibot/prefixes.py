@@ -0,0 +1,108 @@
+"""
+matching the prefixes which mark messages as commands.
+
+Guilds can have their own prefixes in place of the default one, and messages
+starting with a mention of the bot are commands everywhere. The first
+character of every prefix is kept in a set, so that most messages, which
+aren't commands, are rejected with a single lookup however many prefixes
+there are.
+"""
+
+import itertools
+import logging
+from typing import *
+
+import unibot._globals
+
+
+class PrefixesConfig(unibot._globals.config.section, id="prefixes"):
+    # prefixes by guild ID, used in those guilds instead of core.prefix
+    guilds: Dict[str, List[str]] = {}
+    # also treat messages which start with a mention of the bot as commands
+    mention: bool = True
+
+
+def _order(prefixes: Iterable[str]) -> Tuple[str, ...]:
+    # longest first, so that e.g. '!!' is matched before '!'
+    return tuple(sorted(set(filter(None, prefixes)), key=len, reverse=True))
+
+
+class PrefixMatcher:
+    def __init__(self):
+        self.config: Optional[PrefixesConfig] = None
+        self.logger = logging.getLogger("unibot.prefixes")
+        self.default: Tuple[str, ...] = ()
+        self._user_id: Optional[int] = None
+        self._guilds: Dict[int, Tuple[str, ...]] = {}
+        self._mentions: Tuple[str, ...] = ()
+        # the first character of every prefix
+        self._first: FrozenSet[str] = frozenset()
+
+    def load(self, default: str):
+        """
+        :param default: the prefix of guilds without their own, and of DMs
+        """
+        self.config = PrefixesConfig()
+        unibot._globals.config.subscribe("prefixes", self._config_changed)
+        self.set_default(default)
+
+    def _config_changed(self, config: PrefixesConfig):
+        self.config = config
+        self.rebuild()
+
+    def set_default(self, prefix: str):
+        self.default = _order([prefix])
+        self.rebuild()
+
+    def set_user(self, user_id: Optional[int]):
+        """
+        :param user_id: the ID of the bot's user, whose mentions are prefixes
+        """
+        self._user_id = user_id
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        recompiles the prefixes, after the config has been changed
+        """
+        guilds = {}
+        for guild_id, prefixes in self.config.guilds.items():
+            try:
+                guilds[int(guild_id)] = _order(prefixes)
+            except ValueError:
+                self.logger.error("Invalid guild ID '%s' in prefixes", guild_id)
+        mentions = ()
+        if self.config.mention and self._user_id is not None:
+            # the second form is used for members with a nickname
+            mentions = (f"<@{self._user_id}>", f"<@!{self._user_id}>")
+        self._guilds = guilds
+        self._mentions = mentions
+        self._first = frozenset(
+            prefix[0]
+            for prefix in itertools.chain(
+                self.default, mentions, *guilds.values()
+            )
+        )
+
+    def get(self, guild_id: Optional[int]) -> Tuple[str, ...]:
+        """
+        :return: the prefixes of a guild, not including mentions
+        """
+        return self._guilds.get(guild_id, self.default)
+
+    def match(self, content: str, guild_id: Optional[int]) -> int:
+        """
+        :param guild_id: the ID of the guild the message was sent in, or None
+        for DMs
+        :return: the length of the prefix which the content starts with, or 0
+        if it isn't a command
+        """
+        if content[:1] not in self._first:
+            return 0
+        for prefix in self._guilds.get(guild_id, self.default):
+            if content.startswith(prefix):
+                return len(prefix)
+        for prefix in self._mentions:
+            if content.startswith(prefix):
+                return len(prefix)
+        return 0
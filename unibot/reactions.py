@@ -0,0 +1,140 @@
+"""
+routing of reactions to the menus waiting for them.
+
+discord.py's wait_for checks every waiting predicate against every reaction,
+so each reaction costs time proportional to the number of open menus. The
+router instead looks up the menu for a reaction by its message ID.
+"""
+
+import asyncio
+import heapq
+import itertools
+from typing import *
+
+import discord
+
+Check = Callable[[discord.Reaction, discord.User], bool]
+
+
+class ReactionRoute:
+    """
+    receives the reactions added to one message, until it is closed or times
+    out. Use as a context manager to close it when done.
+    """
+
+    __slots__ = (
+        "router",
+        "message_id",
+        "check",
+        "deadline",
+        "closed",
+        "_queue",
+    )
+
+    def __init__(self, router, message_id, check, deadline):
+        self.router: "ReactionRouter" = router
+        self.message_id: int = message_id
+        self.check: Optional[Check] = check
+        self.deadline: Optional[float] = deadline
+        self.closed = False
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def get(self) -> Tuple[discord.Reaction, discord.User]:
+        """
+        waits for the next reaction
+        :raises asyncio.TimeoutError: if the route times out first
+        """
+        item = await self._queue.get()
+        if item is None:
+            # keep raising for any other waiters
+            self._queue.put_nowait(None)
+            raise asyncio.TimeoutError
+        return item
+
+    def close(self):
+        self.router._remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ReactionRouter:
+    def __init__(self):
+        self._routes: Dict[int, ReactionRoute] = {}
+        # (deadline, counter, route) for routes with a timeout; closed routes
+        # are discarded when they reach the top
+        self._deadlines: List[Tuple[float, int, ReactionRoute]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_deadline: Optional[float] = None
+
+    def watch(
+        self,
+        message: discord.Message,
+        check: Optional[Check] = None,
+        timeout: Optional[float] = None,
+    ) -> ReactionRoute:
+        """
+        starts routing the reactions added to a message
+        :param check: if given, only reactions for which this returns True are
+        routed
+        :param timeout: the number of seconds after which the route times out,
+        or None to never time out
+        """
+        if message.id in self._routes:
+            raise ValueError("message is already being watched")
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        route = ReactionRoute(self, message.id, check, deadline)
+        self._routes[message.id] = route
+        if deadline is not None:
+            heapq.heappush(
+                self._deadlines, (deadline, next(self._counter), route)
+            )
+            if self._timer_deadline is None or deadline < self._timer_deadline:
+                self._schedule(loop)
+        return route
+
+    def dispatch(self, reaction: discord.Reaction, user: discord.User):
+        """
+        routes a reaction. This is an inline listener for 'reaction_add'.
+        """
+        route = self._routes.get(reaction.message.id)
+        if route is not None and (
+            route.check is None or route.check(reaction, user)
+        ):
+            route._queue.put_nowait((reaction, user))
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_deadline = None
+
+    def _remove(self, route: ReactionRoute):
+        if not route.closed:
+            route.closed = True
+            del self._routes[route.message_id]
+
+    def _schedule(self, loop: asyncio.AbstractEventLoop):
+        while self._deadlines and self._deadlines[0][2].closed:
+            heapq.heappop(self._deadlines)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_deadline = None
+        if self._deadlines:
+            self._timer_deadline = self._deadlines[0][0]
+            self._timer = loop.call_at(self._timer_deadline, self._expire)
+
+    def _expire(self):
+        self._timer = self._timer_deadline = None
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            _, _, route = heapq.heappop(self._deadlines)
+            if not route.closed:
+                self._remove(route)
+                route._queue.put_nowait(None)
+        self._schedule(loop)
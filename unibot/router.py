@@ -0,0 +1,98 @@
+"""
+compiled command routing.
+
+argparse handles subcommands by parsing every level of the tree in turn,
+which is slow for deeply nested commands. The router instead walks a trie of
+command names built once from the command tree, and only parses the
+arguments of the command that was actually invoked.
+"""
+
+import argparse
+from typing import *
+
+from unibot.command import BaseCommand, CommandWithSubCommands
+
+
+class _Node:
+    __slots__ = ("command", "children")
+
+    def __init__(self, command: BaseCommand):
+        self.command = command
+        self.children: Dict[str, "_Node"] = {}
+
+
+class CommandRouter:
+    def __init__(self, root: CommandWithSubCommands):
+        self.root = root
+        # the node of each command group in the tree, by class
+        self._groups: Dict[Type[CommandWithSubCommands], _Node] = {}
+        self._trie = self._compile(root)
+
+    def _compile(self, command: BaseCommand) -> _Node:
+        node = _Node(command)
+        if isinstance(command, CommandWithSubCommands):
+            self._groups[type(command)] = node
+            for name, subcommand in command._commands_callbacks.items():
+                node.children[name] = self._compile(subcommand)
+        return node
+
+    def _discard(self, node: _Node):
+        if isinstance(node.command, CommandWithSubCommands):
+            del self._groups[type(node.command)]
+            for child in node.children.values():
+                self._discard(child)
+
+    def find_group(
+        self, cls: Type[CommandWithSubCommands]
+    ) -> Optional[CommandWithSubCommands]:
+        """
+        :return: the instance of a command group in the tree, or None if it
+        is not in the tree
+        """
+        node = self._groups.get(cls)
+        return node and node.command
+
+    def add(self, group: CommandWithSubCommands, command: BaseCommand):
+        """
+        adds a command which has been added to a group in the tree
+        """
+        self._groups[type(group)].children[command.name] = self._compile(
+            command
+        )
+
+    def remove(self, group: CommandWithSubCommands, name: str):
+        """
+        removes a command which has been removed from a group in the tree
+        """
+        self._discard(self._groups[type(group)].children.pop(name))
+
+    def find(self, args: Sequence[str]) -> Tuple[BaseCommand, int]:
+        """
+        finds the command invoked by some arguments, without parsing them
+        :param args: the arguments of the message, with the prefix removed
+        :return: the command, and the number of arguments which are its name.
+        If a subcommand is missing or unknown, this is the command group.
+        """
+        node = self._trie
+        i = 0
+        while node.children and i < len(args):
+            child = node.children.get(args[i])
+            if child is None:
+                break
+            node = child
+            i += 1
+        return node.command, i
+
+    def resolve(
+        self, args: Sequence[str]
+    ) -> Tuple[BaseCommand, argparse.Namespace]:
+        """
+        finds the command invoked by some arguments and parses them
+        :param args: the arguments of the message, with the prefix removed
+        :return: the command to call, and the namespace to call it with
+        :raises unibot.parser.CommandError: if the arguments are invalid
+        """
+        command, i = self.find(args)
+        # for a command group, its parser reports the missing or unknown
+        # subcommand just as the full parse would
+        return command, command.parse_args(args[i:])
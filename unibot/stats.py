@@ -0,0 +1,71 @@
+import collections
+import time
+from typing import *
+
+
+class Timings:
+    """
+    counts invocations of some code and how long they took. Percentiles are
+    computed over the most recent invocations only.
+    """
+
+    __slots__ = ("count", "exceptions", "in_flight", "total_time", "_recent")
+
+    def __init__(self, recent: int = 1024):
+        self.count = 0
+        self.exceptions = 0
+        self.in_flight = 0
+        self.total_time = 0.0
+        self._recent: Deque[float] = collections.deque(maxlen=recent)
+
+    def start(self) -> float:
+        self.in_flight += 1
+        return time.perf_counter()
+
+    def finish(self, start: float, failed: bool = False):
+        self.in_flight -= 1
+        self.record(time.perf_counter() - start, failed)
+
+    def record(self, duration: float, failed: bool = False):
+        """
+        counts an invocation which was timed some other way
+        """
+        self.count += 1
+        self.total_time += duration
+        self._recent.append(duration)
+        if failed:
+            self.exceptions += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        :param p: the percentile, from 0 to 100
+        :return: the duration in seconds, or None if there are no invocations
+        """
+        if not self._recent:
+            return None
+        recent = sorted(self._recent)
+        return recent[min(len(recent) - 1, int(len(recent) * p / 100))]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "exceptions": self.exceptions,
+            "in_flight": self.in_flight,
+            "total_time": self.total_time,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+        }
+
+
+class PluginStats:
+    __slots__ = ("commands", "listeners")
+
+    def __init__(self):
+        self.commands = Timings()
+        self.listeners = Timings()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "commands": self.commands.as_dict(),
+            "listeners": self.listeners.as_dict(),
+        }
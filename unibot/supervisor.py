@@ -0,0 +1,177 @@
+"""
+running the bot's shards in several worker processes.
+
+A bot runs on one core, and one gateway connection can only serve a limited
+number of guilds. The supervisor splits the shards between worker processes,
+each running `python -m unibot` with its own range of shards, and restarts
+any worker which crashes. The workers share the config and credentials
+files, and each reloads the config when it changes.
+"""
+
+import asyncio
+import logging
+import signal
+import sys
+import time
+from typing import *
+
+import discord
+
+import unibot.logs
+
+
+def split_shards(shard_count: int, workers: int) -> List[List[int]]:
+    """
+    splits the shards into contiguous ranges, one for each worker, with
+    sizes differing by at most one
+    """
+    workers = min(workers, shard_count)
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (i < extra)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def format_shards(shard_ids: Sequence[int]) -> str:
+    if len(shard_ids) > 1 and list(shard_ids) == list(
+        range(shard_ids[0], shard_ids[-1] + 1)
+    ):
+        return f"{shard_ids[0]}-{shard_ids[-1]}"
+    return ",".join(map(str, shard_ids))
+
+
+def parse_shards(text: str) -> List[int]:
+    """
+    parses a list of shard IDs in the form '0-3' or '0,2,5'
+    """
+    shard_ids = []
+    for part in text.split(","):
+        start, _, end = part.partition("-")
+        if end:
+            shard_ids.extend(range(int(start), int(end) + 1))
+        else:
+            shard_ids.append(int(start))
+    return shard_ids
+
+
+async def recommended_shard_count(token: str) -> int:
+    """
+    :return: the number of shards Discord recommends for the bot
+    """
+    http = discord.http.HTTPClient()
+    try:
+        await http.static_login(token, bot=True)
+        shard_count, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shard_count
+
+
+class Supervisor:
+    FORMAT = "[ {levelname:<7} ] [ {name:<20} ]  {message}"
+    # a worker which crashes after running for this many seconds is
+    # restarted straight away; otherwise the delay doubles each time
+    STABLE_TIME = 60.0
+    MAX_RESTART_DELAY = 60.0
+
+    def __init__(
+        self,
+        workers: int,
+        shard_count: Optional[int],
+        token: str,
+        config_file="config.json",
+        credentials_file="credentials.json",
+    ):
+        self.workers = workers
+        self.shard_count = shard_count
+        self.token = token
+        self.config_file = config_file
+        self.credentials_file = credentials_file
+        self._processes: Set[asyncio.subprocess.Process] = set()
+        self._stopping = False
+
+        self.logger = logging.getLogger("unibot.supervisor")
+        self.logger.setLevel(logging.DEBUG)
+        self._log_listener = unibot.logs.setup(self.logger, self.FORMAT)
+
+    def _command(self, shard_ids: Sequence[int]) -> List[str]:
+        return [
+            sys.executable,
+            "-m",
+            "unibot",
+            "--config",
+            self.config_file,
+            "--credentials",
+            self.credentials_file,
+            "--shard-count",
+            str(self.shard_count),
+            "--shards",
+            format_shards(shard_ids),
+        ]
+
+    async def _supervise(self, shard_ids: Sequence[int]):
+        name = format_shards(shard_ids)
+        delay = 1.0
+        while not self._stopping:
+            started = time.monotonic()
+            # in a new session, so that ctrl-c reaches only the supervisor,
+            # which then stops the workers
+            process = await asyncio.create_subprocess_exec(
+                *self._command(shard_ids), start_new_session=True
+            )
+            self._processes.add(process)
+            self.logger.info(
+                "Started worker %s for shards %s", process.pid, name
+            )
+            code = await process.wait()
+            self._processes.discard(process)
+            if self._stopping or code == 0:
+                self.logger.info("Worker for shards %s exited", name)
+                return
+            if time.monotonic() - started >= self.STABLE_TIME:
+                delay = 1.0
+            self.logger.error(
+                "Worker for shards %s exited with code %s, restarting in %.0fs",
+                name,
+                code,
+                delay,
+            )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RESTART_DELAY)
+
+    def stop(self):
+        """
+        stops the workers, which log out cleanly, and stops restarting them
+        """
+        self._stopping = True
+        for process in self._processes:
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+
+    async def _run(self):
+        if self.shard_count is None:
+            self.shard_count = await recommended_shard_count(self.token)
+        ranges = split_shards(self.shard_count, self.workers)
+        self.logger.info(
+            "Running %s shards in %s workers", self.shard_count, len(ranges)
+        )
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except NotImplementedError:
+                # not supported on windows
+                pass
+        await asyncio.gather(*(self._supervise(r) for r in ranges))
+
+    def run(self):
+        loop = asyncio.get_event_loop()
+        try:
+            loop.run_until_complete(self._run())
+        finally:
+            loop.close()
+            self._log_listener.stop()
@@ -0,0 +1,73 @@
+"""
+running synchronous plugin code without blocking the event loop.
+
+Command callbacks and event listeners which aren't coroutines are run in a
+bounded thread pool. The pool counts how long calls wait for a thread, and
+how often every thread is busy, so that its size can be tuned.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import time
+from typing import *
+
+from unibot.stats import Timings
+
+
+class ThreadPool:
+    def __init__(self, size: Optional[int] = None):
+        """
+        :param size: the maximum number of threads, by default the same as
+        for the standard library's thread pool
+        """
+        self.size = size or min(32, (os.cpu_count() or 1) + 4)
+        # from submission to completion; in_flight counts both the calls
+        # running and those waiting for a thread
+        self.timings = Timings()
+        # how long calls waited for a thread
+        self.wait = Timings()
+        # the number of calls submitted while every thread was busy
+        self.saturated = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            self.size, thread_name_prefix="unibot"
+        )
+
+    @property
+    def busy(self) -> int:
+        return min(self.timings.in_flight, self.size)
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.timings.in_flight - self.size)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        calls a function in the pool, with the current context variables
+        :return: the result of the function
+        """
+        if self.timings.in_flight >= self.size:
+            self.saturated += 1
+        start = self.timings.start()
+        started = []
+        context = contextvars.copy_context()
+
+        def call():
+            started.append(time.perf_counter())
+            return context.run(fn, *args, **kwargs)
+
+        failed = True
+        try:
+            result = await asyncio.get_event_loop().run_in_executor(
+                self._executor, call
+            )
+            failed = False
+            return result
+        finally:
+            if started:
+                self.wait.record(started[0] - start)
+            self.timings.finish(start, failed)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,123 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import pathlib
+from typing import *
+
+# inotify event masks, from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+
+
+def _inotify_watch(directory: pathlib.Path) -> Optional[int]:
+    """
+    creates a non-blocking inotify file descriptor watching a directory for
+    files being written, created or moved into it
+    :return: the file descriptor, or None if inotify is not available
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError, TypeError):
+        return None
+    if fd < 0:
+        return None
+    mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class FileWatcher:
+    """
+    calls a function when a file's modification time or size changes. Uses
+    inotify where available, and otherwise polls the file.
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        callback: Callable[[], Any],
+        poll_interval: float = 2.0,
+        delay: float = 0.1,
+    ):
+        """
+        :param path: the file to watch
+        :param callback: called after the file has changed
+        :param poll_interval: how often to check the file if inotify is not
+        available
+        :param delay: how long to wait after an inotify event before checking
+        the file, so that a burst of events causes only one check
+        """
+        self.path = path
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.delay = delay
+        self.logger = logging.getLogger("unibot.watcher")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._fd: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._last = self._stat()
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        self._fd = _inotify_watch(self.path.parent)
+        if self._fd is not None:
+            self._loop.add_reader(self._fd, self._on_inotify_event)
+            self.logger.debug("Watching '%s' with inotify", self.path)
+        else:
+            self._handle = self._loop.call_later(self.poll_interval, self._poll)
+            self.logger.debug(
+                "Watching '%s' by polling every %ss",
+                self.path,
+                self.poll_interval,
+            )
+
+    def stop(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _stat(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        # the inode changes when the file is replaced, e.g. by an atomic write
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _check(self):
+        self._handle = None
+        current = self._stat()
+        if current is not None and current != self._last:
+            self._last = current
+            try:
+                self.callback()
+            except Exception as e:
+                self.logger.error(
+                    "Exception in watcher callback for '%s'",
+                    self.path,
+                    exc_info=e,
+                )
+
+    def _on_inotify_event(self):
+        # the events themselves don't matter, since the file is checked anyway
+        try:
+            while os.read(self._fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        if self._handle is None:
+            self._handle = self._loop.call_later(self.delay, self._check)
+
+    def _poll(self):
+        self._check()
+        self._handle = self._loop.call_later(self.poll_interval, self._poll)